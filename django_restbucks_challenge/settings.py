@@ -47,11 +47,22 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'restbuck_app.authentication.CachedTokenAuthentication',
+    ],
+    # orjson based JSON renderer and parser if orjson is installed, stdlib json otherwise
+    'DEFAULT_RENDERER_CLASSES': [
+        'restbuck_app.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'restbuck_app.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
     'TEST_REQUEST_DEFAULT_FORMAT': 'json'
 }
 MIDDLEWARE = [
+    'restbuck_app.middleware.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,6 +71,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
+# add Server-Timing header with database and render time to responses
+RESTBUCK_SERVER_TIMING = False
 
 ROOT_URLCONF = 'django_restbucks_challenge.urls'
 
@@ -90,6 +103,20 @@ DATABASES = {
     }
 }
 
+# menu, token and version caches must be shared by all worker processes, so cache invalidation reaches every one.
+# file based cache is shared by processes of one host, needs no other service and runs no database queries.
+# deployments on several hosts must use a cache shared between hosts, e.g. memcached or redis.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'OPTIONS': {
+            # cached tokens are an entry each
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
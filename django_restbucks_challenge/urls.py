@@ -17,12 +17,20 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
-from restbuck_app import views
+from restbuck_app import async_views, views
 
 urlpatterns = [
     path('menu/', views.Menu.as_view(), name='get_menu'),
     path('client_order/', views.OrderView.as_view(), name='client_order'),
     path('client_order/<int:pk>/', views.OrderView.as_view(), name='client_order'),
+    path('client_order/export/', views.OrderExportView.as_view(), name='client_order_export'),
+    path('client_order/batch/', views.BatchOrderView.as_view(), name='client_order_batch'),
+    path('barista_queue/', views.BaristaQueue.as_view(), name='barista_queue'),
+    path('metrics/', views.Metrics.as_view(), name='metrics'),
+    path('async/menu/', async_views.menu, name='async_get_menu'),
+    path('async/client_order/', async_views.client_order, name='async_client_order'),
+    path('async/client_order/<int:pk>/', async_views.client_order, name='async_client_order'),
+    path('async/barista_queue/', async_views.barista_queue, name='async_barista_queue'),
     path('admin/doc/', include('django.contrib.admindocs.urls')),
     path('admin/', admin.site.urls),
     ]
@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db.models import Prefetch
 from restbuck_app.models import *
 # TODO: do not repeat list_display for all class
 # TODO: put registers together or use decorator
@@ -13,6 +14,7 @@ admin.site.register(Feature, FeatureAdmin)
 
 class FeaturesValueAdmin(admin.ModelAdmin):
     list_display = [f.name for f in FeaturesValue._meta.fields]
+    list_select_related = ('feature',)
 
 
 admin.site.register(FeaturesValue, FeaturesValueAdmin)
@@ -20,6 +22,7 @@ admin.site.register(FeaturesValue, FeaturesValueAdmin)
 
 class ProductAdmin(admin.ModelAdmin):
     list_display = [f.name for f in Product._meta.fields]
+    list_select_related = ('feature',)
 
 
 admin.site.register(Product, ProductAdmin)
@@ -28,11 +31,38 @@ admin.site.register(Product, ProductAdmin)
 class ProductOrderInline(admin.TabularInline):
     model = ProductOrder
     extra = 1
+    readonly_fields = ('unit_cost',)
+
+
+def change_state_action(state, state_display):
+    """ admin action to change state of selected orders in bulk, see OrderQuerySet.change_state """
+    def action(modeladmin, request, queryset):
+        changed = queryset.change_state(state)
+        modeladmin.message_user(request, '{} orders marked as {}.'.format(changed, state_display))
+    action.__name__ = 'mark_' + state_display
+    action.short_description = 'Mark selected orders as ' + state_display
+    return action
 
 
 class OrderAdmin(admin.ModelAdmin):
-    list_display = [f.name for f in Order._meta.fields]
+    list_display = [f.name for f in Order._meta.fields] + ['product_summary']
+    list_select_related = ('user',)
+    readonly_fields = ('total_cost', 'item_count')
     inlines = (ProductOrderInline,)
+    actions = [change_state_action(state, state_display) for state, state_display in OrderStatus.types
+               if state != OrderStatus.waiting]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('productorder_set', queryset=ProductOrder.objects.select_related('product')))
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        Order.objects.filter(pk=form.instance.pk).update_totals()
+
+    def product_summary(self, obj):
+        """ ordered products of order from prefetched items, like: 2*Latte, 1*Tea """
+        return ', '.join(item.count.__str__() + '*' + item.product.title for item in obj.productorder_set.all())
 
 
 admin.site.register(Order, OrderAdmin)
@@ -40,8 +70,45 @@ admin.site.register(Order, OrderAdmin)
 
 class ProductOrderAdmin(admin.ModelAdmin):
     list_display = [f.name for f in ProductOrder._meta.fields]
+    list_select_related = ('product', 'order__user', 'feature_value__feature')
+    readonly_fields = ('unit_cost',)
+
+    def get_queryset(self, request):
+        # products of order are shown by Order.__str__
+        return super().get_queryset(request).prefetch_related('order__product_list')
+
+    def save_model(self, request, obj, form, change):
+        order_ids = {obj.order_id, form.initial.get('order')} - {None}
+        super().save_model(request, obj, form, change)
+        Order.objects.filter(pk__in=order_ids).update_totals()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        Order.objects.filter(pk=obj.order_id).update_totals()
+
+    def delete_queryset(self, request, queryset):
+        order_ids = set(queryset.values_list('order', flat=True))
+        super().delete_queryset(request, queryset)
+        Order.objects.filter(pk__in=order_ids).update_totals()
 
 
 admin.site.register(ProductOrder, ProductOrderAdmin)
 
 
+class OrderNotificationAdmin(admin.ModelAdmin):
+    list_display = [f.name for f in OrderNotification._meta.fields]
+    list_select_related = ('order__user',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('order__product_list')
+
+
+admin.site.register(OrderNotification, OrderNotificationAdmin)
+
+
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = [f.name for f in IdempotencyKey._meta.fields]
+    list_select_related = ('user',)
+
+
+admin.site.register(IdempotencyKey, IdempotencyKeyAdmin)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class RestbuckAppConfig(AppConfig):
     name = 'restbuck_app'
+
+    def ready(self):
+        # connect catalog and token cache invalidation signals and query counter of connections, register checks
+        from restbuck_app import authentication, catalog, checks, middleware  # noqa: F401
@@ -0,0 +1,99 @@
+"""
+Async (ASGI native) versions of the client APIs.
+
+Django 3.1 has no async ORM, so each request crosses into a thread just once to run the sync API view
+(authentication, queries and rendering), while waiting (long polling of barista queue) is done in the event loop.
+Notifications do no network I/O in request at all, they are written to outbox (see :mod:`restbuck_app.outbox`).
+
+By default views run in a thread pool, so requests are handled concurrently instead of on the single thread Django
+uses for sync views under ASGI. set ``RESTBUCK_ASYNC_THREAD_SENSITIVE = True`` to run them on that thread instead
+(required by tests, which share one database connection).
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework import status
+
+from restbuck_app import views
+from restbuck_app.versions import ORDER_QUEUE_VERSION_KEY, get_version
+
+POLL_INTERVAL = 0.2
+# maximum seconds a barista queue request waits for a change
+MAX_WAIT = 30
+
+menu_view = views.Menu.as_view()
+order_view = views.OrderView.as_view()
+barista_queue_view = views.BaristaQueue.as_view()
+
+
+def is_thread_sensitive():
+    return getattr(settings, 'RESTBUCK_ASYNC_THREAD_SENSITIVE', False)
+
+
+def _run_view(view, request, *args, **kwargs):
+    """ run a sync API view and render its response, in a thread. """
+    thread_sensitive = is_thread_sensitive()
+    try:
+        response = view(request, *args, **kwargs)
+        response.render()
+        return response
+    finally:
+        if not thread_sensitive:
+            # request_finished signal closes connections of handler thread, not of the pool threads
+            close_old_connections()
+
+
+async def run_view(view, request, *args, **kwargs):
+    return await sync_to_async(_run_view, thread_sensitive=is_thread_sensitive())(view, request, *args, **kwargs)
+
+
+async def menu(request):
+    """ async version of :class:`restbuck_app.views.Menu` API. """
+    return await run_view(menu_view, request)
+
+
+async def client_order(request, pk=0):
+    """ async version of :class:`restbuck_app.views.OrderView` API. """
+    return await run_view(order_view, request, pk=pk)
+
+
+async def barista_queue(request):
+    """ async version of :class:`restbuck_app.views.BaristaQueue` API with long polling, waits in event loop.
+
+    with 'version' of last response and 'wait' seconds, response is sent as soon as queue changes
+    (checked in cache, not database), or 304 if it did not change during wait.
+    """
+    try:
+        wait = min(max(float(request.GET.get('wait', 0)), 0), MAX_WAIT)
+    except ValueError:
+        wait = 0
+    response = await run_view(barista_queue_view, request)
+    if response.status_code != status.HTTP_304_NOT_MODIFIED or not wait:
+        return response
+    client_version = int(request.GET['version'])
+    if await wait_for_queue_change(client_version, wait) != client_version:
+        return await run_view(barista_queue_view, request)
+    return response
+
+
+async def wait_for_queue_change(version, timeout):
+    """ wait in event loop until barista queue version is not the given version, checks just the cache.
+
+    :returns: current version
+    :rtype: int
+    """
+    get_version_async = sync_to_async(get_version, thread_sensitive=is_thread_sensitive())
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    current_version = version
+    while current_version == version and loop.time() < deadline:
+        await asyncio.sleep(min(POLL_INTERVAL, deadline - loop.time()))
+        current_version = await get_version_async(ORDER_QUEUE_VERSION_KEY)
+    return current_version
+
+
+# DRF views are csrf exempt and enforce it in SessionAuthentication themselves.
+for async_view in (menu, client_order, barista_queue):
+    async_view.csrf_exempt = True
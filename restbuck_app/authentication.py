@@ -0,0 +1,123 @@
+"""
+Token authentication with cached token to user resolution.
+
+Resolved tokens are kept in two layers:
+    - process-local bounded LRU with TTL.
+    - django cache shared between processes.
+Deleting a token or saving its user (e.g. deactivating) removes the shared entry and bumps an authentication
+version which drops local entries of all processes. a process reads the shared version at most once per
+``version_check_seconds``, so other processes may still accept a revoked token for that long.
+Every request gets its own copies of the cached user and token, so changes made by one request do not leak to others.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from restbuck_app.versions import AUTH_VERSION_KEY, bump_version, get_version
+
+TOKEN_KEY = 'restbuck_app:token:{}'
+
+
+class LRUCache:
+    """ thread safe bounded least recently used cache with time to live. """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires < time.monotonic():
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.timeout)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ drop-in replacement of TokenAuthentication which does not query database for recently seen tokens. """
+    cache_timeout = 5 * 60
+    local_cache = LRUCache(max_size=10000, timeout=60)
+    version_check_seconds = 5
+    # authentication version of shared cache and when this process read it
+    local_version = (None, 0.0)
+
+    @classmethod
+    def get_auth_version(cls):
+        """ authentication version, read from shared cache at most once per version_check_seconds. """
+        version, read_at = cls.local_version
+        now = time.monotonic()
+        if version is None or now - read_at > cls.version_check_seconds:
+            version = get_version(AUTH_VERSION_KEY)
+            cls.local_version = (version, now)
+        return version
+
+    def authenticate_credentials(self, key):
+        version = self.get_auth_version()
+        cached = self.local_cache.get(key)
+        if cached is not None and cached[0] == version:
+            return self.copy_user_token(cached[1])
+
+        user_token = cache.get(TOKEN_KEY.format(key))
+        if user_token is None:
+            user_token = super().authenticate_credentials(key)
+            cache.set(TOKEN_KEY.format(key), user_token, self.cache_timeout)
+        elif not user_token[0].is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        self.local_cache.set(key, (version, user_token))
+        return self.copy_user_token(user_token)
+
+    @staticmethod
+    def copy_user_token(user_token):
+        """ copies of a cached user and its token, for one request. """
+        user, token = copy.copy(user_token[0]), copy.copy(user_token[1])
+        token.user = user
+        return user, token
+
+
+def invalidate_token(key):
+    """ forget cached resolution of a token in all processes. """
+    cache.delete(TOKEN_KEY.format(key))
+    bump_version(AUTH_VERSION_KEY)
+    # this process reads the new version right away
+    CachedTokenAuthentication.local_version = (None, 0.0)
+
+
+def token_deleted(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # login just updates last_login, which does not change authentication
+    if not created and update_fields != frozenset(['last_login']):
+        for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+            invalidate_token(key)
+
+
+post_delete.connect(token_deleted, sender=Token, dispatch_uid='cached_token_deleted')
+post_save.connect(user_saved, sender=User, dispatch_uid='cached_token_user_saved')
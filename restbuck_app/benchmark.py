@@ -0,0 +1,314 @@
+"""
+Latency and query benchmark of the client APIs.
+
+Loads the `init` fixture catalog, generates synthetic users and order histories and measures latency percentiles,
+queries per request and throughput of each API scenario in process (no network), one request at a time and with
+concurrent requests under the ASGI handler.
+used by `benchmark` management command, which runs it on a fresh test database and writes results to JSON.
+"""
+import asyncio
+import io
+import itertools
+import json
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import urlencode
+from rest_framework.authtoken.models import Token
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from restbuck_app.models import ConsumeLocation, FeaturesValue, Order, OrderStatus, Product, ProductOrder
+from restbuck_app import renderers
+from restbuck_app.parsers import FastJSONParser
+from restbuck_app.renderers import FastJSONRenderer
+from restbuck_app.serializers import OrderSerializer, ProductSerializer, serialize_order, serialize_product
+
+BATCH_SIZE = 2000
+
+
+def percentile(sorted_samples, percent):
+    """ nearest rank percentile of sorted samples. """
+    index = max(int(round(percent / 100 * len(sorted_samples))) - 1, 0)
+    return sorted_samples[index]
+
+
+def summarize(durations, query_counts, response_sizes):
+    """ statistics of a scenario, durations in seconds.
+
+    :rtype: dict
+    """
+    durations = sorted(durations)
+    total = sum(durations)
+    return {
+        'requests': len(durations),
+        'p50_ms': percentile(durations, 50) * 1000,
+        'p95_ms': percentile(durations, 95) * 1000,
+        'p99_ms': percentile(durations, 99) * 1000,
+        'mean_ms': statistics.mean(durations) * 1000,
+        'throughput_rps': len(durations) / total if total else None,
+        'queries_per_request': statistics.mean(query_counts),
+        'max_queries': max(query_counts),
+        'mean_response_bytes': statistics.mean(response_sizes),
+    }
+
+
+def measure(send_request, requests):
+    """ send requests one by one, measuring latency, queries and response size of each.
+
+    :param send_request: callable taking request number and returning response.
+    :rtype: dict
+    """
+    durations, query_counts, response_sizes = [], [], []
+    for number in range(requests):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            response = send_request(number)
+            durations.append(time.perf_counter() - started)
+        assert response.status_code < 400, response.content
+        query_counts.append(len(context.captured_queries))
+        response_sizes.append(len(response.content))
+    return summarize(durations, query_counts, response_sizes)
+
+
+def summarize_concurrent(durations, elapsed, concurrency):
+    """ statistics of a scenario of concurrent requests, durations and elapsed (wall clock) time in seconds.
+
+    :rtype: dict
+    """
+    durations = sorted(durations)
+    return {
+        'requests': len(durations),
+        'concurrency': concurrency,
+        'p50_ms': percentile(durations, 50) * 1000,
+        'p95_ms': percentile(durations, 95) * 1000,
+        'p99_ms': percentile(durations, 99) * 1000,
+        'throughput_rps': len(durations) / elapsed if elapsed else None,
+    }
+
+
+async def measure_concurrent(async_client, path, headers, requests, concurrency):
+    """ send GET requests through ASGI handler, concurrency requests at a time.
+
+    :rtype: dict
+    """
+    durations = []
+
+    async def send():
+        started = time.perf_counter()
+        response = await async_client.get(path, **headers)
+        durations.append(time.perf_counter() - started)
+        assert response.status_code < 400, response.content
+
+    started = time.perf_counter()
+    for sent in range(0, requests, concurrency):
+        await asyncio.gather(*(send() for _ in range(min(concurrency, requests - sent))))
+    return summarize_concurrent(durations, time.perf_counter() - started, concurrency)
+
+
+def random_item(rng, products, feature_values):
+    product = rng.choice(products)
+    values = feature_values.get(product.feature_id)
+    return {'product': product.id,
+            'count': rng.randint(1, 3),
+            'consume_location': rng.choice(ConsumeLocation.types)[0],
+            'feature_value': rng.choice(values).id if values else None}
+
+
+def generate_data(users, orders, items_per_order, seed=0):
+    """ load catalog fixture and bulk insert synthetic users with their order history.
+
+    orders are distributed round robin between users, so the first user has orders // users orders.
+
+    :returns: tokens of generated users
+    :rtype: list
+    """
+    call_command('loaddata', 'init', verbosity=0)
+    rng = random.Random(seed)
+    products = list(Product.objects.all())
+    feature_values = {}
+    for feature_value in FeaturesValue.objects.all():
+        feature_values.setdefault(feature_value.feature_id, []).append(feature_value)
+
+    User.objects.bulk_create([User(username='benchmark{}'.format(i)) for i in range(users)], BATCH_SIZE)
+    user_ids = list(User.objects.filter(username__startswith='benchmark').order_by('id').values_list('id', flat=True))
+    Token.objects.bulk_create([Token(user_id=user_id, key=Token.generate_key()) for user_id in user_ids], BATCH_SIZE)
+
+    products_by_id = {product.id: product for product in products}
+    order_user_ids = itertools.islice(itertools.cycle(user_ids), orders)
+    while True:
+        batch, batch_items = [], []
+        for user_id in itertools.islice(order_user_ids, BATCH_SIZE):
+            items = []
+            for _ in range(items_per_order):
+                item = random_item(rng, products, feature_values)
+                items.append(ProductOrder(product_id=item['product'], count=item['count'],
+                                          consume_location=item['consume_location'],
+                                          feature_value_id=item['feature_value'],
+                                          unit_cost=products_by_id[item['product']].cost))
+            order = Order(user_id=user_id, state=rng.choice(OrderStatus.types)[0])
+            order.set_totals(items)
+            batch.append(order)
+            batch_items.append(items)
+        if not batch:
+            break
+        # bulk_create does not set ids on every database, read them back
+        last_id = Order.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        Order.objects.bulk_create(batch)
+        order_ids = Order.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)
+        for order_id, items in zip(order_ids, batch_items):
+            for item in items:
+                item.order_id = order_id
+        ProductOrder.objects.bulk_create([item for items in batch_items for item in items], BATCH_SIZE)
+    return list(Token.objects.filter(user_id__in=user_ids).order_by('user_id'))
+
+
+def run_benchmark(users=100, orders=1000, items_per_order=3, requests=200, seed=0):
+    """ generate data and measure every API scenario as the first generated user.
+
+    :returns: results of scenarios by name
+    :rtype: dict
+    """
+    token = generate_data(users, orders, items_per_order, seed)[0]
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+    rng = random.Random(seed)
+    products = list(Product.objects.all())
+    feature_values = {}
+    for feature_value in FeaturesValue.objects.all():
+        feature_values.setdefault(feature_value.feature_id, []).append(feature_value)
+    user_order_ids = list(Order.objects.for_user(token.user_id).active().values_list('id', flat=True))
+
+    def new_order_data():
+        return {'data': [random_item(rng, products, feature_values) for _ in range(items_per_order)]}
+
+    results = {
+        'menu': measure(lambda n: client.get(reverse('get_menu')), requests),
+        'order_list': measure(lambda n: client.get(reverse('client_order')), requests),
+        'order_detail': measure(lambda n: client.get(reverse('client_order', args=(rng.choice(user_order_ids),))),
+                                requests),
+        'order_create': measure(lambda n: client.post(reverse('client_order'), new_order_data()), requests),
+    }
+    # orders created by the create scenario are waiting, so they can be modified and canceled
+    waiting_order_ids = list(Order.objects.for_user(token.user_id).active().filter(state=OrderStatus.waiting)
+                             .order_by('-id').values_list('id', flat=True)[:requests])
+    results['order_modify'] = measure(
+        lambda n: client.post(reverse('client_order', args=(waiting_order_ids[n % len(waiting_order_ids)],)),
+                              new_order_data()), requests)
+    results['order_cancel'] = measure(
+        lambda n: client.delete(reverse('client_order', args=(waiting_order_ids[n],))),
+        min(requests, len(waiting_order_ids)))
+    return results
+
+
+def measure_asgi(requests=200, concurrency=20, long_polls=10, long_poll_wait=2):
+    """ measure client APIs with concurrent requests under the ASGI handler, as the first generated user.
+
+    sync views run on the single thread django uses for sync code under ASGI, their async versions run in a thread
+    pool (see :mod:`restbuck_app.async_views`). async menu is measured once more while barista queue long polls wait.
+    requests are sent from an event loop of its own, so it must be called from sync code with committed data.
+
+    :returns: results of scenarios by name
+    :rtype: dict
+    """
+    token = Token.objects.filter(user__username__startswith='benchmark').order_by('user_id').first()
+    barista, _ = User.objects.get_or_create(username='benchmark_barista', defaults={'is_staff': True})
+    barista_token, _ = Token.objects.get_or_create(user=barista)
+    headers = {'AUTHORIZATION': 'Token ' + token.key}
+    barista_headers = {'AUTHORIZATION': 'Token ' + barista_token.key}
+    scenarios = (('menu', 'get_menu'), ('async_menu', 'async_get_menu'),
+                 ('order_list', 'client_order'), ('async_order_list', 'async_client_order'))
+
+    async def run():
+        async_client = AsyncClient()
+        results = {}
+        for name, url_name in scenarios:
+            results[name] = await measure_concurrent(async_client, reverse(url_name), headers, requests, concurrency)
+
+        response = await async_client.get(reverse('async_barista_queue'), **barista_headers)
+        # query string is put in path, AsyncClient of django 3.1 drops query data of GET
+        path = reverse('async_barista_queue') + '?' + urlencode(
+            {'version': json.loads(response.content)['version'], 'wait': long_poll_wait})
+        polls = [asyncio.ensure_future(async_client.get(path, **barista_headers)) for _ in range(long_polls)]
+        results['async_menu_long_poll'] = await measure_concurrent(async_client, reverse('async_get_menu'), headers,
+                                                                   requests, concurrency)
+        await asyncio.gather(*polls)
+        return results
+
+    return asyncio.run(run())
+
+
+def best_time(func, repeat):
+    """ shortest duration of calls in seconds, and result of last call. """
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        durations.append(time.perf_counter() - started)
+    return min(durations), result
+
+
+def measure_serialization(orders=1000, repeat=5):
+    """ compare rendering a page of orders and the menu with DRF serializers and with the fast path ones.
+
+    data is loaded once, so just serialization and JSON encoding are measured. both outputs must be identical.
+
+    :returns: results by payload, with durations in milliseconds
+    :rtype: dict
+    """
+    renderer = JSONRenderer()
+    page = list(Order.objects.with_product_list().order_by('id')[:orders])
+    products = list(ProductSerializer.setup_eager_loading(Product.objects.all()))
+    payloads = {
+        'order_page': (lambda: OrderSerializer(page, many=True).data,
+                       lambda: [serialize_order(order) for order in page]),
+        'menu': (lambda: ProductSerializer(products, many=True).data,
+                 lambda: [serialize_product(product) for product in products]),
+    }
+    results = {}
+    for name, (serialize, fast_serialize) in payloads.items():
+        drf_seconds, content = best_time(lambda: renderer.render(serialize()), repeat)
+        fast_seconds, fast_content = best_time(lambda: renderer.render(fast_serialize()), repeat)
+        assert fast_content == content, name
+        results[name] = {'objects': len(page) if name == 'order_page' else len(products),
+                         'drf_ms': drf_seconds * 1000,
+                         'fast_ms': fast_seconds * 1000,
+                         'speedup': drf_seconds / fast_seconds}
+    return results
+
+
+def measure_json(orders=1000, repeat=5):
+    """ compare DRF JSON renderer and parser with the fast ones on a page of orders and the menu.
+
+    rendered bytes must be identical.
+
+    :returns: engine of fast ones and results by payload, with durations in milliseconds
+    :rtype: dict
+    """
+    payloads = {
+        'order_page': [serialize_order(order)
+                       for order in Order.objects.with_product_list().order_by('id')[:orders]],
+        'menu': [serialize_product(product)
+                 for product in ProductSerializer.setup_eager_loading(Product.objects.all())],
+    }
+    results = {'engine': 'orjson' if renderers.orjson is not None else 'json'}
+    for name, data in payloads.items():
+        render_seconds, content = best_time(lambda: JSONRenderer().render(data), repeat)
+        fast_render_seconds, fast_content = best_time(lambda: FastJSONRenderer().render(data), repeat)
+        assert fast_content == content, name
+        parse_seconds, _ = best_time(lambda: JSONParser().parse(io.BytesIO(content)), repeat)
+        fast_parse_seconds, _ = best_time(lambda: FastJSONParser().parse(io.BytesIO(content)), repeat)
+        results[name] = {'bytes': len(content),
+                         'render_ms': render_seconds * 1000,
+                         'fast_render_ms': fast_render_seconds * 1000,
+                         'parse_ms': parse_seconds * 1000,
+                         'fast_parse_ms': fast_parse_seconds * 1000}
+    return results
@@ -0,0 +1,98 @@
+"""
+Catalog (menu) cache.
+
+The menu only changes when a manager edits :model:`restbuck_app.Product`, :model:`restbuck_app.Feature` or
+:model:`restbuck_app.FeaturesValue`, so the serialized menu is kept in two layers keyed by a catalog version:
+
+    - process-local layer: serialized data and its already-encoded JSON bytes of the latest version.
+    - shared layer: the default django cache backend, which must be shared between processes (see CACHES setting).
+
+Every save or delete of a catalog model (admin included) bumps the version, so stale menus are never served.
+Note: ``QuerySet.update`` does not send signals, call :func:`bump_catalog_version` after such bulk edits.
+"""
+import threading
+
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from restbuck_app.models import Feature, FeaturesValue, Product
+from restbuck_app.renderers import FastJSONRenderer
+from restbuck_app.versions import CATALOG_VERSION_KEY, bump_version, get_version
+
+MENU_KEY = 'restbuck_app:catalog:menu:{}'
+MENU_TIMEOUT = 24 * 60 * 60
+
+_local_lock = threading.Lock()
+_local_menu = {'version': None, 'data': None, 'content': None}
+
+
+def get_catalog_version():
+    """ current catalog version, shared between processes through django cache.
+
+    :rtype: int
+    """
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version(**kwargs):
+    """ invalidate cached menu of all processes, used as receiver of catalog models signals. """
+    bump_version(CATALOG_VERSION_KEY)
+
+
+def menu_etag(version):
+    """ strong entity tag of menu for a catalog version. """
+    return '"menu-{}"'.format(version)
+
+
+def get_menu(build_data, version=None):
+    """ get serialized menu of a catalog version from cache layers or build it.
+
+    :param build_data: callable returning serialized menu response data, called on cache miss.
+    :param version: catalog version, current version if not provided.
+    :returns: response data and its JSON encoded content
+    :rtype: tuple
+    """
+    if version is None:
+        version = get_catalog_version()
+    with _local_lock:
+        if _local_menu['version'] == version:
+            return _local_menu['data'], _local_menu['content']
+
+    cached = cache.get(MENU_KEY.format(version))
+    if cached is None:
+        data = build_data()
+        content = FastJSONRenderer().render(data)
+        cache.set(MENU_KEY.format(version), (data, content), MENU_TIMEOUT)
+    else:
+        data, content = cached
+
+    with _local_lock:
+        _local_menu.update(version=version, data=data, content=content)
+    return data, content
+
+
+class PreRenderedResponse(Response):
+    """ Response which skips rendering when the accepted renderer is a JSON renderer and content is known. """
+    # renderers rendering same bytes as content
+    prerendered_renderers = (JSONRenderer, FastJSONRenderer)
+
+    def __init__(self, data, content, **kwargs):
+        super().__init__(data, **kwargs)
+        self.prerendered_content = content
+
+    @property
+    def rendered_content(self):
+        renderer = getattr(self, 'accepted_renderer', None)
+        if type(renderer) in self.prerendered_renderers and \
+                renderer.get_indent(self.accepted_media_type, self.renderer_context) is None:
+            self['Content-Type'] = self.content_type or renderer.media_type
+            return self.prerendered_content
+        return super().rendered_content
+
+
+for catalog_model in (Product, Feature, FeaturesValue):
+    post_save.connect(bump_catalog_version, sender=catalog_model, dispatch_uid='catalog_save_' + catalog_model.__name__)
+    post_delete.connect(bump_catalog_version, sender=catalog_model,
+                        dispatch_uid='catalog_delete_' + catalog_model.__name__)
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# backends keeping entries in memory of each process, cache invalidation of one process does not reach others
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """ menu, token and version caches must be shared between worker processes. """
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_CACHE_BACKENDS:
+        return [Error('default cache backend {} is not shared between processes.'.format(backend),
+                      hint='configure a shared cache backend in CACHES setting, e.g. file based, memcached or redis.',
+                      id='restbuck_app.E001')]
+    return []
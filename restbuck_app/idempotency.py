@@ -0,0 +1,107 @@
+"""
+Idempotency-Key support of client order APIs.
+
+A client sends a unique ``Idempotency-Key`` header with a create, modify or cancel request and the same header with
+its retries. The first request runs and its response is stored in :model:`restbuck_app.IdempotencyKey`, retries are
+answered from the stored response with one indexed lookup, without running the order pipeline again.
+
+    - duplicates sent while the first request is running get 409, the unique key row serializes them.
+    - a key reused with another request (method, path or data) gets 422.
+    - responses with server errors are not stored, so the request can be retried.
+    - keys are kept for IDEMPOTENCY_KEY_TTL seconds, see `clear_idempotency_keys` command.
+"""
+import datetime
+import functools
+import hashlib
+import json
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from restbuck_app.models import IdempotencyKey
+
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+# a request still in progress after this many seconds is considered abandoned, e.g. its process was killed
+IN_PROGRESS_TIMEOUT = 60
+
+
+def request_fingerprint(request):
+    """ hash of method, path and data of request. """
+    content = json.dumps([request.method, request.path, request.data], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def replay_response(record, fingerprint):
+    """ response to a retry of a request, from its stored record. """
+    if record.fingerprint != fingerprint:
+        return Response({'error': True, 'message': 'Idempotency-Key is used by another request'},
+                        status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if record.status_code is None:
+        response = Response({'error': True, 'message': 'request with this Idempotency-Key is in progress'},
+                            status.HTTP_409_CONFLICT)
+        response['Retry-After'] = '1'
+        return response
+    response = Response(record.response_data, record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def start_request(user, key, fingerprint):
+    """ claim key for a new request.
+
+    :returns: claimed record, or response of an already claimed key
+    :rtype: tuple
+    """
+    now = timezone.now()
+    record = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if record is None:
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(user=user, key=key, fingerprint=fingerprint, created_at=now), None
+        except IntegrityError:
+            # concurrent duplicate claimed it first
+            record = IdempotencyKey.objects.get(user=user, key=key)
+    expired = record.created_at < now - datetime.timedelta(seconds=IDEMPOTENCY_KEY_TTL)
+    abandoned = record.status_code is None and \
+        record.created_at < now - datetime.timedelta(seconds=IN_PROGRESS_TIMEOUT)
+    if expired or abandoned:
+        # take over the key, unless another request just took it over
+        claimed = IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).update(
+            fingerprint=fingerprint, status_code=None, response_data=None, created_at=now)
+        if claimed:
+            record.fingerprint, record.status_code, record.response_data, record.created_at = \
+                fingerprint, None, None, now
+            return record, None
+        record.refresh_from_db()
+    return None, replay_response(record, fingerprint)
+
+
+def idempotent(handler):
+    """ decorator of API view handlers, makes requests with Idempotency-Key header safe to retry. """
+
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if not key:
+            return handler(view, request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return Response({'error': True, 'message': 'Not valid Idempotency-Key'}, status.HTTP_400_BAD_REQUEST)
+
+        record, response = start_request(request.user, key, request_fingerprint(request))
+        if response is not None:
+            return response
+        try:
+            response = handler(view, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        if response.status_code >= 500:
+            record.delete()
+        else:
+            IdempotencyKey.objects.filter(pk=record.pk).update(status_code=response.status_code,
+                                                                response_data=response.data)
+        return response
+
+    return wrapper
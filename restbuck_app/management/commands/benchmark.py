@@ -0,0 +1,71 @@
+import json
+import subprocess
+
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, \
+    teardown_test_environment
+
+from restbuck_app.benchmark import measure_asgi, measure_json, measure_serialization, run_benchmark
+
+
+def current_commit():
+    """ git commit of working tree, None if it is not a git repository. """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Measure latency, queries and throughput of APIs on generated data in a new test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='number of generated users')
+        parser.add_argument('--orders', type=int, default=1000,
+                            help='number of generated orders, e.g. 1000, 100000 or 1000000')
+        parser.add_argument('--items', type=int, default=3, help='items of each generated and submitted order')
+        parser.add_argument('--requests', type=int, default=200, help='requests sent for each scenario')
+        parser.add_argument('--concurrency', type=int, default=20, help='concurrent requests of ASGI scenarios')
+        parser.add_argument('--seed', type=int, default=0, help='seed of random data')
+        parser.add_argument('--output', help='write results to this JSON file, compare it between commits')
+
+    def handle(self, *args, **options):
+        # same environment as tests: test database, allowed test host and in-memory email backend
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            results = run_benchmark(options['users'], options['orders'], options['items'], options['requests'],
+                                    options['seed'])
+            asgi_results = measure_asgi(options['requests'], options['concurrency'])
+            serialization = measure_serialization()
+            json_results = measure_json()
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'commit': current_commit(),
+            'parameters': {key: options[key] for key in ('users', 'orders', 'items', 'requests', 'concurrency',
+                                                         'seed')},
+            'results': results,
+            'asgi': asgi_results,
+            'serialization': serialization,
+            'json': json_results,
+        }
+        for name, result in results.items():
+            self.stdout.write('{:<14} p50 {p50_ms:8.2f}ms  p95 {p95_ms:8.2f}ms  p99 {p99_ms:8.2f}ms  '
+                              '{throughput_rps:8.1f} req/s  {queries_per_request:5.1f} queries'.format(name, **result))
+        for name, result in asgi_results.items():
+            self.stdout.write('asgi {:<20} p50 {p50_ms:8.2f}ms  p95 {p95_ms:8.2f}ms  p99 {p99_ms:8.2f}ms  '
+                              '{throughput_rps:8.1f} req/s  {concurrency} concurrent'.format(name, **result))
+        for name, result in serialization.items():
+            self.stdout.write('{:<14} {objects} objects  DRF {drf_ms:8.2f}ms  fast path {fast_ms:8.2f}ms  '
+                              'x{speedup:.1f}'.format(name, **result))
+        for name in ('order_page', 'menu'):
+            self.stdout.write('{:<14} {bytes} bytes  render {render_ms:.2f}ms, {engine} {fast_render_ms:.2f}ms  '
+                              'parse {parse_ms:.2f}ms, {engine} {fast_parse_ms:.2f}ms'.format(
+                                  name, engine=json_results['engine'], **json_results[name]))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
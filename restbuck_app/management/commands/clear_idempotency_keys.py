@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from restbuck_app.idempotency import IDEMPOTENCY_KEY_TTL
+from restbuck_app.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Delete idempotency keys older than their time to live, run it periodically.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, default=IDEMPOTENCY_KEY_TTL, help='seconds keys are kept')
+
+    def handle(self, *args, **options):
+        deleted, _ = IdempotencyKey.objects.expired(options['ttl']).delete()
+        self.stdout.write('deleted: {}'.format(deleted))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from restbuck_app.outbox import deliver_pending_notifications
+
+
+class Command(BaseCommand):
+    help = 'Send pending order notifications of outbox, with retries and backoff for failed ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='send all pending notifications and exit')
+        parser.add_argument('--batch-size', type=int, default=100, help='notifications sent per batch')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='seconds to wait when there is no pending notification')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = deliver_pending_notifications(options['batch_size'])
+            if sent or failed:
+                self.stdout.write('sent: {}, failed: {}'.format(sent, failed))
+            if sent + failed < options['batch_size']:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
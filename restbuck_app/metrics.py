@@ -0,0 +1,101 @@
+"""
+Per view request metrics.
+
+:class:`MetricsRegistry` keeps, per view and HTTP method, totals of requests, database queries, database time,
+render (serialization) time and response size, and a histogram of request duration.
+It is filled by :class:`restbuck_app.middleware.QueryMetricsMiddleware` and exported in Prometheus text format.
+Metrics are kept in process memory, so every worker process is a separate Prometheus target.
+"""
+import bisect
+import threading
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+SUMS = (
+    ('queries', 'restbuck_request_queries', 'Database queries run by requests.'),
+    ('db_seconds', 'restbuck_request_db_seconds', 'Time spent in database queries by requests.'),
+    ('render_seconds', 'restbuck_request_render_seconds', 'Time spent rendering (serializing) responses.'),
+    ('response_bytes', 'restbuck_response_bytes', 'Size of response bodies.'),
+)
+
+
+class ViewMetrics:
+    """ totals of one view and method. """
+    __slots__ = ('requests', 'queries', 'db_seconds', 'render_seconds', 'response_bytes', 'duration_seconds',
+                 'duration_buckets')
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.render_seconds = 0.0
+        self.response_bytes = 0
+        self.duration_seconds = 0.0
+        # requests per duration bucket, last one is +Inf, not cumulative
+        self.duration_buckets = [0] * (len(DURATION_BUCKETS) + 1)
+
+
+class MetricsRegistry:
+    """ thread safe registry of request metrics by view and method. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view, method, duration, queries, db_seconds, render_seconds, response_bytes):
+        bucket = bisect.bisect_left(DURATION_BUCKETS, duration)
+        with self.lock:
+            metrics = self.views.get((view, method))
+            if metrics is None:
+                metrics = self.views[(view, method)] = ViewMetrics()
+            metrics.requests += 1
+            metrics.queries += queries
+            metrics.db_seconds += db_seconds
+            metrics.render_seconds += render_seconds
+            metrics.response_bytes += response_bytes
+            metrics.duration_seconds += duration
+            metrics.duration_buckets[bucket] += 1
+
+    def get(self, view, method):
+        """ metrics of a view and method, None if it has no request yet.
+
+        :rtype: ViewMetrics
+        """
+        return self.views.get((view, method))
+
+    def clear(self):
+        with self.lock:
+            self.views.clear()
+
+    def render_prometheus(self):
+        """ metrics in Prometheus text exposition format.
+
+        :rtype: str
+        """
+        with self.lock:
+            snapshot = sorted(self.views.items())
+            lines = ['# HELP restbuck_request_duration_seconds Duration of requests.',
+                     '# TYPE restbuck_request_duration_seconds histogram']
+            for (view, method), metrics in snapshot:
+                labels = 'view="{}",method="{}"'.format(escape_label(view), method)
+                cumulative = 0
+                for le, count in zip(DURATION_BUCKETS + ('+Inf',), metrics.duration_buckets):
+                    cumulative += count
+                    lines.append('restbuck_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(
+                        labels, le, cumulative))
+                lines.append('restbuck_request_duration_seconds_sum{{{}}} {}'.format(labels, metrics.duration_seconds))
+                lines.append('restbuck_request_duration_seconds_count{{{}}} {}'.format(labels, metrics.requests))
+            for attribute, name, help_text in SUMS:
+                lines += ['# HELP {} {}'.format(name, help_text), '# TYPE {} summary'.format(name)]
+                for (view, method), metrics in snapshot:
+                    labels = 'view="{}",method="{}"'.format(escape_label(view), method)
+                    lines.append('{}_sum{{{}}} {}'.format(name, labels, getattr(metrics, attribute)))
+                    lines.append('{}_count{{{}}} {}'.format(name, labels, metrics.requests))
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,112 @@
+import asyncio
+import contextvars
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from restbuck_app.metrics import registry
+
+# query counter of current request, copied by asgiref into the threads running sync code of the request
+current_counter = contextvars.ContextVar('restbuck_query_counter', default=None)
+
+
+class QueryCounter:
+    """ counter of queries and their time. """
+    __slots__ = ('queries', 'seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+def count_query(execute, sql, params, many, context):
+    """ database execute wrapper adding queries to counter of current request, if any. """
+    counter = current_counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counter.seconds += time.perf_counter() - started
+        counter.queries += 1
+
+
+def install_query_counter(connection, **kwargs):
+    """ add count_query to wrappers of a connection, receiver of connection_created signal. """
+    if count_query not in connection.execute_wrappers:
+        # first, so context managers of execute_wrapper popping the last wrapper do not remove it
+        connection.execute_wrappers.insert(0, count_query)
+
+
+connection_created.connect(install_query_counter, dispatch_uid='restbuck_install_query_counter')
+# connections of this thread opened before this module was imported
+for opened_connection in connections.all():
+    install_query_counter(opened_connection)
+
+
+class QueryMetricsMiddleware:
+    """ record query count, database time, render time and response size of every request in metrics registry.
+
+    queries are counted by a database execute wrapper of every connection into the counter of current request, kept
+    in a context variable, so it works with DEBUG off, adds no per query storage and under ASGI counts queries of
+    the threads running sync views too. set RESTBUCK_SERVER_TIMING setting to add a Server-Timing header with the same
+    measures to responses. it is async capable, so under ASGI it does not serialize requests through the single thread
+    of sync code.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # mark instance as a coroutine function for django handler, as MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        request.render_seconds = 0.0
+        started = time.perf_counter()
+        token = current_counter.set(counter)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_counter.reset(token)
+        self.record(request, response, time.perf_counter() - started, counter)
+        return response
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        request.render_seconds = 0.0
+        started = time.perf_counter()
+        token = current_counter.set(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_counter.reset(token)
+        self.record(request, response, time.perf_counter() - started, counter)
+        return response
+
+    def record(self, request, response, duration, counter):
+        resolver_match = getattr(request, 'resolver_match', None)
+        view = resolver_match.view_name if resolver_match is not None else 'unresolved'
+        response_bytes = 0 if response.streaming else len(response.content)
+        registry.record(view, request.method, duration, counter.queries, counter.seconds, request.render_seconds,
+                        response_bytes)
+        if getattr(settings, 'RESTBUCK_SERVER_TIMING', False):
+            response['Server-Timing'] = 'db;dur={:.2f};desc="{} queries", render;dur={:.2f}, total;dur={:.2f}'.format(
+                counter.seconds * 1000, counter.queries, request.render_seconds * 1000, duration * 1000)
+
+    def process_template_response(self, request, response):
+        """ measure rendering of response, e.g. JSON encoding of serialized data of API views. """
+        started = time.perf_counter()
+
+        def rendered(response):
+            request.render_seconds = time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
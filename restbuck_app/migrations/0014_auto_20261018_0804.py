@@ -0,0 +1,23 @@
+# Generated by Django 3.1.7 on 2026-10-18 04:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restbuck_app', '0013_auto_20210318_1205'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='revision',
+            field=models.PositiveIntegerField(default=0, help_text='incremented on every change, used as ETag of order'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, help_text='last change time of order'),
+        ),
+    ]
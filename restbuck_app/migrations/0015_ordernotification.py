@@ -0,0 +1,30 @@
+# Generated by Django 3.1.7 on 2026-10-18 04:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restbuck_app', '0014_auto_20261018_0804'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('previous_state', models.SmallIntegerField(choices=[(0, 'waiting'), (1, 'preparation'), (2, 'ready'), (3, 'delivered')])),
+                ('new_state', models.SmallIntegerField(choices=[(0, 'waiting'), (1, 'preparation'), (2, 'ready'), (3, 'delivered')])),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, help_text='not sent before this time')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, help_text='number of failed sends')),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('failed', models.BooleanField(default=False, help_text='gave up sending after max attempts')),
+                ('last_error', models.TextField(blank=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='restbuck_app.order')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.7 on 2026-10-18 04:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restbuck_app', '0015_ordernotification'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(is_deleted=False), fields=['user', 'id'], name='order_active_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(is_deleted=False), fields=['state', 'id'], name='order_active_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ordernotification',
+            index=models.Index(condition=models.Q(('failed', False), ('sent_at__isnull', True)), fields=['next_attempt_at'], name='notification_pending_idx'),
+        ),
+    ]
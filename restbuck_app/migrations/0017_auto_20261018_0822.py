@@ -0,0 +1,44 @@
+# Generated by Django 3.1.7 on 2026-10-18 04:52
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_costs(apps, schema_editor):
+    """ snapshot current product cost on existing items and compute totals of existing orders. """
+    Product = apps.get_model('restbuck_app', 'Product')
+    ProductOrder = apps.get_model('restbuck_app', 'ProductOrder')
+    Order = apps.get_model('restbuck_app', 'Order')
+    ProductOrder.objects.update(unit_cost=models.Subquery(
+        Product.objects.filter(pk=models.OuterRef('product')).values('cost')))
+    items = ProductOrder.objects.filter(order=models.OuterRef('pk')).order_by().values('order')
+    Order.objects.update(
+        total_cost=Coalesce(models.Subquery(
+            items.annotate(total=models.Sum(models.F('count') * models.F('unit_cost'))).values('total')), 0),
+        item_count=Coalesce(models.Subquery(items.annotate(total=models.Sum('count')).values('total')), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restbuck_app', '0016_auto_20261018_0811'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, help_text='number of ordered products, sum of items count'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_cost',
+            field=models.IntegerField(default=0, help_text='cost of all items, snapshot costs of items'),
+        ),
+        migrations.AddField(
+            model_name='productorder',
+            name='unit_cost',
+            field=models.IntegerField(default=0, help_text='cost of one product at order time'),
+        ),
+        migrations.RunPython(fill_costs, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,11 @@
-from django.core.mail import send_mail
-from django.db import models
+import datetime
+
+from django.db import connections, models, transaction
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django_restbucks_challenge.settings import EMAIL_SENDER_NOREPLAY
-from restbuck_app import notifications
-from restbuck_app.notifications import ClientOrderStatusChange
+from restbuck_app.versions import ORDER_QUEUE_VERSION_KEY, bump_version
 
 # TODO: make enums, class attributes or just public enum in models.py or better in choices.py or better IntegerChoices
 #  because models have table that we do not want it
@@ -93,10 +95,114 @@ class ProductOrder(models.Model):
     consume_location = models.SmallIntegerField(choices=ConsumeLocation.types)
     feature_value = models.ForeignKey(FeaturesValue, on_delete=models.PROTECT, help_text="ordered option of product",
                                       null=True, blank=True)
+    unit_cost = models.IntegerField(default=0, help_text="cost of one product at order time")
 
     def __str__(self):
         return self.count.__str__() + '*' + self.product.title + '--orderNo: ' + self.order.id.__str__()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # product of stored item, to snapshot cost again when product is changed (e.g. in admin)
+        instance._stored_product_id = instance.__dict__.get('product_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """ snapshot product cost on new items and on items whose product changed.
+
+        bulk_create callers set unit_cost themselves.
+        """
+        product_changed = getattr(self, '_stored_product_id', None) not in (None, self.product_id)
+        if (self._state.adding and not self.unit_cost) or product_changed:
+            self.unit_cost = self.product.cost
+        super().save(*args, **kwargs)
+        self._stored_product_id = self.product_id
+
+
+class OrderQuerySet(models.QuerySet):
+    """ reusable lookups of client orders. """
+
+    def active(self):
+        """ orders not canceled by client """
+        return self.filter(is_deleted=False)
+
+    def for_user(self, user):
+        """ orders owned by user """
+        return self.filter(user=user)
+
+    def open(self):
+        """ orders baristas should work on (waiting or in preparation), oldest first """
+        return self.active().filter(state__in=(OrderStatus.waiting, OrderStatus.preparation)).order_by('id')
+
+    def with_product_list(self):
+        """ prefetch product list of orders, see :meth:`product_list_prefetch` """
+        return self.prefetch_related(self.product_list_prefetch())
+
+    def change_state(self, state):
+        """ move orders forward to a state in bulk, without per order save.
+
+        just not canceled orders in an earlier state change. notifications of all of them are written to outbox
+        in the same transaction, so it runs a fixed number of queries however many orders change.
+
+        :param state: new state, one of :model:`restbuck_app.OrderStatus` types.
+        :returns: number of changed orders
+        :rtype: int
+        """
+        with transaction.atomic(savepoint=False):
+            changes = list(self.active().filter(state__lt=state).select_for_update().values_list('id', 'state'))
+            if not changes:
+                return 0
+            Order.objects.filter(id__in=[order_id for order_id, _ in changes], state__lt=state).update(
+                state=state, previous_state=state, revision=models.F('revision') + 1, updated_at=timezone.now())
+            OrderNotification.objects.bulk_create([
+                OrderNotification(order_id=order_id, previous_state=previous_state, new_state=state)
+                for order_id, previous_state in changes])
+            bump_version(ORDER_QUEUE_VERSION_KEY)
+        return len(changes)
+
+    def update_totals(self):
+        """ recompute total cost and item count of orders from their items with one query, mark orders changed.
+
+        used when items are changed without loading them, e.g. by admin. views set totals from items in memory.
+        """
+        items = ProductOrder.objects.filter(order=models.OuterRef('pk')).order_by().values('order')
+        total_cost = items.annotate(total=models.Sum(models.F('count') * models.F('unit_cost'))).values('total')
+        item_count = items.annotate(total=models.Sum('count')).values('total')
+        updated = self.update(total_cost=Coalesce(models.Subquery(total_cost), 0),
+                              item_count=Coalesce(models.Subquery(item_count), 0),
+                              revision=models.F('revision') + 1, updated_at=timezone.now())
+        bump_version(ORDER_QUEUE_VERSION_KEY)
+        return updated
+
+    def bulk_create_with_items(self, orders, items_of_orders):
+        """ insert new orders and all of their items, items with one query.
+
+        orders are inserted with one query on databases returning ids of bulk inserts (PostgreSQL), one by one
+        otherwise, as their ids are needed by items.
+
+        :param orders: unsaved orders, with their totals set.
+        :param items_of_orders: unsaved ProductOrder items of each order.
+        """
+        with transaction.atomic(savepoint=False):
+            if connections[self.db].features.can_return_rows_from_bulk_insert:
+                for order in orders:
+                    order.revision += 1
+                self.bulk_create(orders)
+            else:
+                for order in orders:
+                    order.save()
+            for order, items in zip(orders, items_of_orders):
+                for item in items:
+                    item.order = order
+            ProductOrder.objects.bulk_create([item for items in items_of_orders for item in items])
+            bump_version(ORDER_QUEUE_VERSION_KEY)
+
+    @staticmethod
+    def product_list_prefetch():
+        """ prefetch of order items with their product and feature value, loaded in one query for all orders. """
+        return models.Prefetch('productorder_set',
+                               queryset=ProductOrder.objects.select_related('product', 'feature_value'))
+
 
 class Order(models.Model):
     """ Store a Client order. """
@@ -108,6 +214,20 @@ class Order(models.Model):
     product_list = models.ManyToManyField(Product, through=ProductOrder, related_name='products',
                                           help_text="list of products client ordered")
     is_deleted = models.BooleanField(default=False)
+    revision = models.PositiveIntegerField(default=0, help_text="incremented on every change, used as ETag of order")
+    updated_at = models.DateTimeField(auto_now=True, help_text="last change time of order")
+    total_cost = models.IntegerField(default=0, help_text="cost of all items, snapshot costs of items")
+    item_count = models.PositiveIntegerField(default=0, help_text="number of ordered products, sum of items count")
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # client order list and lookups: active orders of a user, in id (cursor) order
+            models.Index(fields=['user', 'id'], condition=models.Q(is_deleted=False), name='order_active_user_idx'),
+            # barista queue: active orders by state, oldest first
+            models.Index(fields=['state', 'id'], condition=models.Q(is_deleted=False), name='order_active_state_idx'),
+        ]
 
     def __str__(self):
         return 'id:' + self.id.__str__() + '-' + \
@@ -115,14 +235,111 @@ class Order(models.Model):
                ', '.join([x.title for x in self.product_list.all()])
 
     def save(self, *args, **kwargs):
-        """ override default save method to notify user on state change."""
+        """ override default save method to notify user on state change.
+
+        notification is written to outbox in the same transaction and sent later by `send_notifications` command.
+        """
         # TODO: as it is logically bind to admin, this logic should be handle in admin
+        notification = None
         if self.previous_state != self.state:
-            cosc = ClientOrderStatusChange()
-            cosc.send_email(receiver=self.user.email, order_id=self.id,
-                            previous_state=self.get_previous_state_display(),
-                            new_state=self.get_state_display())
+            notification = OrderNotification(previous_state=self.previous_state, new_state=self.state)
             self.previous_state = self.state
-        return super(Order, self).save(*args, **kwargs)
+        self.revision += 1
+        with transaction.atomic(savepoint=False):
+            super(Order, self).save(*args, **kwargs)
+            if notification is not None:
+                notification.order = self
+                notification.save()
+            bump_version(ORDER_QUEUE_VERSION_KEY)
+
+    def touch(self, *fields):
+        """ mark order as changed without saving other fields, used when just product list changed.
 
+        :param fields: other fields to save in the same update, e.g. totals set by :meth:`set_totals`.
+        """
+        self.revision += 1
+        self.updated_at = timezone.now()
+        Order.objects.filter(pk=self.pk).update(revision=models.F('revision') + 1, updated_at=self.updated_at,
+                                                **{field: getattr(self, field) for field in fields})
+        bump_version(ORDER_QUEUE_VERSION_KEY)
 
+    def set_totals(self, items):
+        """ set total cost and item count from all items of order, without query.
+
+        :param items: ProductOrder items of order.
+        """
+        self.total_cost = self.item_count = 0
+        for item in items:
+            self.total_cost += item.count * item.unit_cost
+            self.item_count += item.count
+
+    def get_etag(self, catalog_version):
+        """ strong entity tag of order current revision and catalog version, order data has product titles too. """
+        return '"order-{}-{}-{}"'.format(self.id, self.revision, catalog_version)
+
+
+class OrderNotificationQuerySet(models.QuerySet):
+    def pending(self, now=None):
+        """ notifications not sent yet which their next attempt time has come. """
+        return self.filter(sent_at__isnull=True, failed=False, next_attempt_at__lte=now or timezone.now())
+
+
+class OrderNotification(models.Model):
+    """ Outbox of :model:`restbuck_app.Order` state change emails.
+
+    written in the same transaction as the state change, sent with retries by `send_notifications` command.
+    """
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE)
+    previous_state = models.SmallIntegerField(choices=OrderStatus.types)
+    new_state = models.SmallIntegerField(choices=OrderStatus.types)
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now, help_text="not sent before this time")
+    attempts = models.PositiveSmallIntegerField(default=0, help_text="number of failed sends")
+    sent_at = models.DateTimeField(null=True, blank=True)
+    failed = models.BooleanField(default=False, help_text="gave up sending after max attempts")
+    last_error = models.TextField(blank=True)
+
+    objects = OrderNotificationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # outbox worker: pending notifications by next attempt time
+            models.Index(fields=['next_attempt_at'], name='notification_pending_idx',
+                         condition=models.Q(sent_at__isnull=True, failed=False)),
+        ]
+
+    def __str__(self):
+        return 'orderNo: ' + self.order_id.__str__() + '-' + self.get_previous_state_display() + '-->' + \
+               self.get_new_state_display()
+
+
+class IdempotencyKeyQuerySet(models.QuerySet):
+    def expired(self, ttl, now=None):
+        """ keys older than ttl seconds, their requests are not replayed anymore. """
+        return self.filter(created_at__lt=(now or timezone.now()) - datetime.timedelta(seconds=ttl))
+
+
+class IdempotencyKey(models.Model):
+    """ Result of a client request sent with an Idempotency-Key header, replayed to retries of the request.
+
+    see :mod:`restbuck_app.idempotency`.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, help_text="hash of method, path and data of request")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True,
+                                                   help_text="status of response, empty while request is in progress")
+    response_data = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = IdempotencyKeyQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_unique'),
+        ]
+
+    def __str__(self):
+        return self.user_id.__str__() + '-' + self.key
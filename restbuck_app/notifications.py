@@ -1,27 +1,124 @@
-from django.core.mail import send_mail
+import smtplib
+import time
 
-from django_restbucks_challenge.settings import EMAIL_SENDER_NOREPLAY
+from django.core.mail import EmailMessage, get_connection
 
-# TODO: send email asynchronous, or use django-mailer for bigger projects
+from django_restbucks_challenge.settings import EMAIL_SENDER_NOREPLAY
 
 
 class Notify:
-    def __init__(self):
+    """ send emails over one reusable connection of the email backend.
+
+    emails can be sent right away (send_email) or queued (queue_email) and sent in batches by flush.
+    use as a context manager (or call close) to release the connection.
+    a stale connection is reopened, note that resending a batch after disconnection may resend its first messages.
+    """
+    batch_size = 100
+    # seconds a connection can be idle before it is checked to be alive
+    idle_check_seconds = 30
+
+    def __init__(self, connection=None):
         self.email_sender = EMAIL_SENDER_NOREPLAY
+        self.connection = connection or get_connection(fail_silently=False)
+        self.queued_messages = []
+        # number of messages sent over each opened connection
+        self.sent_per_connection = []
+        self.is_open = False
+        self.last_used = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def connections_opened(self):
+        return len(self.sent_per_connection)
+
+    @property
+    def sent_count(self):
+        return sum(self.sent_per_connection)
+
+    def open(self):
+        """ open connection if it is not open or is not alive anymore. """
+        if self.is_open and time.monotonic() - self.last_used > self.idle_check_seconds and not self.is_alive():
+            self.close()
+        if not self.is_open:
+            self.connection.open()
+            self.is_open = True
+            self.sent_per_connection.append(0)
+
+    def is_alive(self):
+        """ check SMTP connection with NOOP command, other backends has no connection to check. """
+        smtp = getattr(self.connection, 'connection', None)
+        if smtp is None:
+            return True
+        try:
+            return smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def close(self):
+        if self.is_open:
+            try:
+                self.connection.close()
+            finally:
+                self.is_open = False
+
+    def send_messages(self, messages):
+        """ send messages over current connection, reconnect once if connection is stale.
+
+        :returns: number of sent messages
+        :rtype: int
+        """
+        self.open()
+        try:
+            sent = self.connection.send_messages(messages)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self.close()
+            self.open()
+            sent = self.connection.send_messages(messages)
+        sent = sent or 0
+        self.sent_per_connection[-1] += sent
+        self.last_used = time.monotonic()
+        return sent
+
+    def build_email(self, email_subject, email_body, sender, receivers):
+        return EmailMessage(email_subject, email_body, sender, receivers, connection=self.connection)
 
     def send_email(self, email_subject, email_body, sender, receivers):
-        send_mail(email_subject, email_body, sender, receivers, fail_silently=False)
+        return self.send_messages([self.build_email(email_subject, email_body, sender, receivers)])
+
+    def queue_email(self, email_subject, email_body, sender, receivers):
+        self.queued_messages.append(self.build_email(email_subject, email_body, sender, receivers))
+
+    def flush(self):
+        """ send queued emails in batches.
+
+        :returns: number of sent messages
+        :rtype: int
+        """
+        sent = 0
+        while self.queued_messages:
+            batch = self.queued_messages[:self.batch_size]
+            sent += self.send_messages(batch)
+            del self.queued_messages[:self.batch_size]
+        return sent
 
 
 class ClientOrderStatusChange(Notify):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, connection=None):
+        super().__init__(connection)
         self.email_subject = 'Order state changed!'
         self.email_body = 'your order numbered {} has been changed from {} state to {}.\n Best\nRestBucks CoffeeShop'
 
-    def send_email(self, receiver, order_id, previous_state, new_state):
-        self.email_body = self.email_body.format(order_id, previous_state, new_state)
-        super().send_email(self.email_subject, self.email_body, self.email_sender, [receiver])
-
+    def build_status_email(self, receiver, order_id, previous_state, new_state):
+        email_body = self.email_body.format(order_id, previous_state, new_state)
+        return self.build_email(self.email_subject, email_body, self.email_sender, [receiver])
 
+    def send_email(self, receiver, order_id, previous_state, new_state):
+        return self.send_messages([self.build_status_email(receiver, order_id, previous_state, new_state)])
 
+    def queue_email(self, receiver, order_id, previous_state, new_state):
+        self.queued_messages.append(self.build_status_email(receiver, order_id, previous_state, new_state))
@@ -0,0 +1,89 @@
+"""
+Delivery of order notifications outbox (:model:`restbuck_app.OrderNotification`).
+
+Order state changes just write an outbox row, this module sends them out of request with retries and
+exponential backoff. used by `send_notifications` management command.
+"""
+import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from restbuck_app.models import OrderNotification
+from restbuck_app.notifications import ClientOrderStatusChange
+
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 60 * 60
+
+
+def backoff_delay(attempts):
+    """ wait time before next attempt after number of failed attempts.
+
+    :rtype: datetime.timedelta
+    """
+    return datetime.timedelta(seconds=min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS))
+
+
+def send_batch(notify, messages):
+    """ send messages with one call of email backend, one by one if the batch fails.
+
+    sending one by one finds the failing messages, so they do not fail the others. messages sent before the batch
+    failed are sent again.
+
+    :returns: exception of each message, None for sent ones
+    :rtype: list
+    """
+    try:
+        notify.send_messages(messages)
+        return [None] * len(messages)
+    except Exception:
+        errors = []
+        for message in messages:
+            try:
+                notify.send_messages([message])
+            except Exception as e:
+                errors.append(e)
+            else:
+                errors.append(None)
+        return errors
+
+
+def deliver_pending_notifications(batch_size=100):
+    """ send a batch of due notifications, reschedule failed ones with backoff.
+
+    rows are locked while sending (where database supports it), so multiple workers do not send twice.
+    all emails of a batch are sent over one connection with one call of email backend.
+
+    :returns: number of sent and failed notifications
+    :rtype: tuple
+    """
+    sent = failed = 0
+    with transaction.atomic():
+        notifications = list(OrderNotification.objects.pending()
+                             .select_for_update(skip_locked=True)
+                             .select_related('order__user')
+                             .order_by('next_attempt_at')[:batch_size])
+        if not notifications:
+            return sent, failed
+        notify = ClientOrderStatusChange()
+        messages = [notify.build_status_email(receiver=notification.order.user.email,
+                                              order_id=notification.order_id,
+                                              previous_state=notification.get_previous_state_display(),
+                                              new_state=notification.get_new_state_display())
+                    for notification in notifications]
+        with notify:
+            errors = send_batch(notify, messages)
+        for notification, error in zip(notifications, errors):
+            if error is not None:
+                failed += 1
+                notification.attempts += 1
+                notification.last_error = repr(error)
+                notification.failed = notification.attempts >= MAX_ATTEMPTS
+                notification.next_attempt_at = timezone.now() + backoff_delay(notification.attempts)
+            else:
+                sent += 1
+                notification.sent_at = timezone.now()
+        OrderNotification.objects.bulk_update(notifications,
+                                              ['attempts', 'last_error', 'failed', 'next_attempt_at', 'sent_at'])
+    return sent, failed
@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class OrderCursorPagination(CursorPagination):
+    """ keyset pagination of client orders, response keeps API format with link of next page. """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = 'id'
+
+    def get_paginated_response(self, data):
+        return Response({'data': data,
+                         'next': self.get_next_link(),
+                         'error': False})
@@ -0,0 +1,37 @@
+"""
+JSON parser using orjson when it is installed, falls back to DRF JSONParser (stdlib json) otherwise.
+
+orjson reads integers over 64 bits as floats and rejects numbers out of double range (e.g. 1e400), stdlib json
+reads them as int and inf. so content with such numbers, and content orjson rejects, is parsed by stdlib json and
+results are the same as JSONParser.
+"""
+import codecs
+import io
+import re
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+from restbuck_app.renderers import FastJSONRenderer, orjson
+
+# 19 digits may be out of 64 bits (e.g. below -2**63), matches in strings too, which just parses them with stdlib json
+LONG_NUMBER = re.compile(rb'\d{19}')
+
+
+class FastJSONParser(JSONParser):
+    """ JSONParser using orjson for UTF-8 requests if available, it rejects NaN and Infinity like STRICT_JSON. """
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or not self.strict or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+        content = stream.read()
+        if not LONG_NUMBER.search(content):
+            try:
+                return orjson.loads(content)
+            except orjson.JSONDecodeError:
+                # not valid or out of double range, stdlib json decides and reports error
+                pass
+        return super().parse(io.BytesIO(content), media_type, parser_context)
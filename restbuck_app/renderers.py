@@ -0,0 +1,33 @@
+"""
+JSON renderer using orjson when it is installed, falls back to DRF JSONRenderer (stdlib json) otherwise.
+
+for payloads without floats, like the API payloads, orjson renders the same bytes as JSONRenderer: compact UTF-8
+JSON, tuples (like ``ConsumeLocation.types``) as arrays and other types (lazy strings, datetimes, decimals, ...)
+converted by DRF encoder. payloads orjson can not render (integers over 64 bits, non-string keys) and indented output
+use stdlib json.
+Note: floats have the same value but may be written differently in exponent notation, e.g. 1e16 instead of 1e+16,
+and NaN and Infinity floats are rendered as null instead of raising ValueError of STRICT_JSON.
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """ JSONRenderer using orjson if available, same bytes for payloads without floats. """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact or \
+                self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # like JSONRenderer, escape line and paragraph separators to be a strict javascript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
@@ -1,3 +1,5 @@
+from django.db import transaction
+from django.db.models import Prefetch
 from rest_framework import serializers
 from rest_framework.fields import SerializerMethodField, CharField, ReadOnlyField
 from restbuck_app.models import *
@@ -21,7 +23,7 @@ class FeatureWithValuesSerializer(serializers.ModelSerializer):
         fields = ('title', 'value_list')
 
     def get_value_list(self, obj):
-        """ get serialized feature values related to Feature obj.
+        """ get serialized feature values related to Feature obj, uses prefetched values if available.
 
         :rtype: serialized FeatureValues
 
@@ -48,24 +50,161 @@ class ProductSerializer(serializers.ModelSerializer):
     def get_consume_location(self, obj):
         return ConsumeLocation.types
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """ load features and their values of products in fixed number of queries. """
+        return queryset.select_related('feature').prefetch_related(
+            Prefetch('feature__featuresvalue_set', queryset=FeaturesValue.objects.all()))
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """ PrimaryKeyRelatedField which reads objects preloaded in serializer context instead of one query per item.
+
+    falls back to default query if nothing is preloaded, e.g. for a single serializer.
+    """
+
+    def __init__(self, preloaded_key, **kwargs):
+        self.preloaded_key = preloaded_key
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get(self.preloaded_key)
+        if preloaded is None:
+            return super().to_internal_value(data)
+        pk = to_pk(data)
+        if pk is None:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        obj = preloaded.get(pk)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+
+def to_pk(value):
+    """ convert submitted value to primary key, None if it is not a valid one. """
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_stored_pk(pk):
+    """ whether primary key fits a 64 bit database integer, larger ones do not exist and can not be queried. """
+    return pk is not None and -2 ** 63 <= pk < 2 ** 63
+
+
+class ProductOrderListSerializer(serializers.ListSerializer):
+    """ List serializer of order items, inserts new order items in bulk and writes just the changes of an order.
+
+    products and feature values of all items are loaded with one query each before validation.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.preload_catalog(data)
+        return super().to_internal_value(data)
+
+    def preload_catalog(self, data):
+        """ load products and feature values of submitted items into context, used by items related fields.
+
+        already preloaded objects are not loaded again, so a parent serializer can preload all of its orders.
+        """
+        product_ids, feature_value_ids = set(), set()
+        for item in data:
+            if isinstance(item, dict):
+                product_ids.add(to_pk(item.get('product')))
+                feature_value_ids.add(to_pk(item.get('feature_value')))
+        products = self.context.setdefault('preloaded_products', {})
+        feature_values = self.context.setdefault('preloaded_feature_values', {})
+        missing_product_ids = {pk for pk in product_ids - products.keys() if is_stored_pk(pk)}
+        missing_feature_value_ids = {pk for pk in feature_value_ids - feature_values.keys() if is_stored_pk(pk)}
+        if missing_product_ids:
+            products.update(Product.objects.in_bulk(missing_product_ids))
+        if missing_feature_value_ids:
+            feature_values.update(FeaturesValue.objects.in_bulk(missing_feature_value_ids))
+
+    @staticmethod
+    def item_key(product_id, feature_value_id, consume_location):
+        """ identity of an order item, items with same key are the same line of order. """
+        return product_id, feature_value_id, consume_location
+
+    def create(self, validated_data):
+        """ insert all items of an order with one query.
+
+        :returns: created items, related product and feature value are already loaded by validation.
+        :rtype: list
+        """
+        items = [ProductOrder(**attrs) for attrs in validated_data]
+        ProductOrder.objects.bulk_create(items)
+        return items
+
+    def update(self, instance, validated_data):
+        """ apply submitted items to current items of an order with minimum inserts, updates and deletes.
+
+        :param instance: current ProductOrder items of order.
+        :param validated_data: submitted items, with the order they belong to.
+        :returns: items of order in submitted order.
+        :rtype: list
+        """
+        current_items = {}
+        for item in instance:
+            key = self.item_key(item.product_id, item.feature_value_id, item.consume_location)
+            current_items.setdefault(key, []).append(item)
+
+        items, to_create, to_update = [], [], []
+        for attrs in validated_data:
+            feature_value = attrs.get('feature_value')
+            key = self.item_key(attrs['product'].id, feature_value.id if feature_value else None,
+                                attrs['consume_location'])
+            matched_items = current_items.get(key)
+            if matched_items:
+                # kept items keep cost of their order time
+                item = matched_items.pop(0)
+                if item.count != attrs['count']:
+                    item.count = attrs['count']
+                    to_update.append(item)
+            else:
+                item = ProductOrder(**attrs)
+                to_create.append(item)
+            items.append(item)
+        to_delete = [item.id for unmatched_items in current_items.values() for item in unmatched_items]
+
+        with transaction.atomic(savepoint=False):
+            if to_delete:
+                ProductOrder.objects.filter(id__in=to_delete).delete()
+            if to_update:
+                ProductOrder.objects.bulk_update(to_update, ['count'])
+            if to_create:
+                ProductOrder.objects.bulk_create(to_create)
+        return items
+
 
 class ProductOrderFlatSerializer(serializers.ModelSerializer):
     """ Product Order flat serializer used for OrderView API. """
+    product = PreloadedPrimaryKeyRelatedField('preloaded_products', queryset=Product.objects.all())
+    feature_value = PreloadedPrimaryKeyRelatedField('preloaded_feature_values', queryset=FeaturesValue.objects.all(),
+                                                    required=False, allow_null=True,
+                                                    help_text="ordered option of product")
     product_title = ReadOnlyField(source='product.title', read_only=True)
     consume_location_display = CharField(source='get_consume_location_display', read_only=True)
     feature_value_title = CharField(source='feature_value.title', read_only=True, required=False)
 
     class Meta:
         model = ProductOrder
-        fields = ('product', 'product_title', 'count', 'consume_location', 'consume_location_display',
+        fields = ('product', 'product_title', 'count', 'unit_cost', 'consume_location', 'consume_location_display',
                   'feature_value', 'feature_value_title')
+        read_only_fields = ('unit_cost',)
+        list_serializer_class = ProductOrderListSerializer
 
-    def validate_feature_value(self, data):
-        feature_value_id = self.initial_data[0].get('feature_value', 0)
-        product_id = self.initial_data[0].get('product', 0)
-        if not FeaturesValue.objects.filter(id=feature_value_id, feature__product=product_id).exists():
-            raise serializers.ValidationError("FeatureValue is not related to product")
-        return data
+    def validate(self, attrs):
+        """ check ordered feature value is an option of ordered product, without query, snapshot product cost. """
+        feature_value = attrs.get('feature_value')
+        if feature_value is not None and feature_value.feature_id != attrs['product'].feature_id:
+            raise serializers.ValidationError({'feature_value': "FeatureValue is not related to product"})
+        attrs['unit_cost'] = attrs['product'].cost
+        return attrs
 
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -75,4 +214,58 @@ class OrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = ('id', 'state', 'product_list')
+        fields = ('id', 'state', 'total_cost', 'item_count', 'product_list')
+
+
+# Read-only fast path of OrderSerializer, ProductOrderFlatSerializer and ProductSerializer.
+# they build the same data as the DRF serializers (same keys in same order and same value types, so rendered JSON
+# is byte-identical) with plain attribute access, without binding fields per instance.
+# keep them in sync with the serializers above, tests compare both outputs.
+
+CONSUME_LOCATION_VALUES = {str(value): value for value, _ in ConsumeLocation.types}
+CONSUME_LOCATION_DISPLAY = dict(ConsumeLocation.types)
+ORDER_STATUS_DISPLAY = dict(OrderStatus.types)
+
+
+def serialize_product_order(item):
+    """ data of ProductOrderFlatSerializer, related product and feature value should be loaded. """
+    consume_location = item.consume_location
+    data = {'product': item.product_id,
+            'product_title': item.product.title,
+            'count': int(item.count),
+            'unit_cost': int(item.unit_cost),
+            'consume_location': CONSUME_LOCATION_VALUES.get(str(consume_location), consume_location),
+            'consume_location_display': str(CONSUME_LOCATION_DISPLAY.get(consume_location, consume_location)),
+            'feature_value': item.feature_value_id}
+    # like DRF, not required feature_value_title is skipped when there is no feature value
+    if item.feature_value_id is not None:
+        data['feature_value_title'] = str(item.feature_value.title)
+    return data
+
+
+def serialize_order(order, items=None):
+    """ data of OrderSerializer, product list should be prefetched, see OrderQuerySet.with_product_list.
+
+    :param items: ProductOrder items of order, e.g. just created ones, instead of its prefetched product list.
+    """
+    if items is None:
+        items = order.productorder_set.all()
+    return {'id': int(order.id),
+            'state': str(ORDER_STATUS_DISPLAY.get(order.state, order.state)),
+            'total_cost': int(order.total_cost),
+            'item_count': int(order.item_count),
+            'product_list': [serialize_product_order(item) for item in items]}
+
+
+def serialize_product(product):
+    """ data of ProductSerializer, see ProductSerializer.setup_eager_loading. """
+    feature = product.feature
+    if feature is not None:
+        feature = {'title': str(feature.title),
+                   'value_list': [{'id': int(value.id), 'title': str(value.title)}
+                                  for value in feature.featuresvalue_set.all()]}
+    return {'id': int(product.id),
+            'title': str(product.title),
+            'cost': int(product.cost),
+            'consume_location': ConsumeLocation.types,
+            'feature': feature}
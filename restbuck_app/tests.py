@@ -1,19 +1,71 @@
+import asyncio
+import datetime
+import json
+import re
+import smtplib
+import time
 from distutils.command.install import install
-
-from django.test import TestCase, Client
+from contextlib import contextmanager
+from collections import OrderedDict
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from asgiref.sync import sync_to_async
+from django.test import AsyncClient, TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.urls import reverse
+from django.utils.http import urlencode
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
 from rest_framework import status
 from rest_framework.authtoken.models import Token
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
+from restbuck_app import catalog, outbox
+from restbuck_app.authentication import TOKEN_KEY, CachedTokenAuthentication, LRUCache
+from restbuck_app.checks import check_shared_cache
+from restbuck_app.notifications import ClientOrderStatusChange
+from restbuck_app.parsers import FastJSONParser
+from restbuck_app.renderers import FastJSONRenderer
+from restbuck_app.outbox import deliver_pending_notifications
+from restbuck_app.async_views import wait_for_queue_change
+from restbuck_app.metrics import MetricsRegistry, registry
+from restbuck_app.benchmark import generate_data, measure_asgi, measure_json, measure_serialization, percentile, \
+    run_benchmark
+from restbuck_app.versions import AUTH_VERSION_KEY, ORDER_QUEUE_VERSION_KEY, bump_version, get_version
 from restbuck_app.serializers import *
 from restbuck_app.models import *
-from restbuck_app.views import OrderView
+from restbuck_app.views import Menu, OrderExportView, OrderView
 
 client = APIClient()
 # TODO: we must subclass classes form DRF APITestCase that has its own APIclient
 # TODO: separate test files
 
 
+class QueryBudgetMixin:
+    """ assert maximum number of queries of an API scenario, catches N+1 queries as data grows.
+
+    unlike assertNumQueries, a budget is an upper bound, so it is declared once per scenario and checked with
+    several data sizes. failure message lists the captured SQL.
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, budget, scenario):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        queries = context.captured_queries
+        if len(queries) > budget:
+            sql = '\n'.join('{}. {}'.format(number, query['sql']) for number, query in enumerate(queries, 1))
+            self.fail('{} ran {} queries, budget is {}:\n{}'.format(scenario, len(queries), budget, sql))
+
+
 class FeatureModelTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -79,7 +131,7 @@ class OrderTest(TestCase):
         self.assertEqual(field_label, 'is deleted')
 
 
-class MenuViewTest(TestCase):
+class MenuViewTest(QueryBudgetMixin, TestCase):
     def setUp(self) -> None:
         size_feature = Feature.objects.create(title='size')
         thermal_feature = Feature.objects.create(title='thermal')
@@ -106,8 +158,63 @@ class MenuViewTest(TestCase):
         response = client.get(reverse('get_menu'))
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
+    def test_get_menu_cached(self):
+        first_response = client.get(reverse('get_menu'))
+        # token comes from authentication cache and menu from catalog cache
+        with self.assertNumQueries(0):
+            response = client.get(reverse('get_menu'))
+        self.assertEqual(response.content, first_response.content)
+        self.assertEqual(json.loads(response.content), json.loads(JSONRenderer().render(first_response.data)))
+
+    def test_get_menu_invalidated_on_catalog_change(self):
+        client.get(reverse('get_menu'))
+        product = Product.objects.get(title='water')
+        product.title = 'mineral water'
+        product.save()
+        FeaturesValue.objects.create(title='medium', feature=product.feature)
+        response = client.get(reverse('get_menu'))
+        serializer = ProductSerializer(Product.objects.all(), many=True)
+        self.assertEqual(response.data.get('data'), serializer.data)
+        Product.objects.get(title='milk').delete()
+        response = client.get(reverse('get_menu'))
+        self.assertEqual(len(response.data.get('data')), 1)
 
-class OrderViewTest(TestCase):
+    def test_get_menu_not_modified(self):
+        response = client.get(reverse('get_menu'))
+        etag = response['ETag']
+        response = client.get(reverse('get_menu'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        Product.objects.create(title='tea', cost='3')
+        response = client.get(reverse('get_menu'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_get_menu_query_budget(self):
+        features = list(Feature.objects.all())
+        for catalog_size in (10, 100):
+            Product.objects.bulk_create([Product(title='product' + str(i), cost=i, feature=features[i % 2])
+                                         for i in range(catalog_size)])
+            catalog.bump_catalog_version()
+            # token authentication, products joined with features, feature values
+            with self.assertQueryBudget(3, 'menu of {} products'.format(catalog_size)):
+                response = client.get(reverse('get_menu'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_build_menu_fixed_number_of_queries(self):
+        features = list(Feature.objects.all())
+        for catalog_size in (10, 100, 1000):
+            Product.objects.all().delete()
+            Product.objects.bulk_create([Product(title='product' + str(i), cost=i, feature=features[i % 2])
+                                         for i in range(catalog_size)])
+            # products joined with features, feature values
+            with self.assertNumQueries(2):
+                data = Menu.build_menu().get('data')
+            self.assertEqual(len(data), catalog_size)
+            self.assertEqual(len(data[0]['feature']['value_list']), 2)
+
+
+class OrderViewTest(QueryBudgetMixin, TestCase):
     def setUp(self) -> None:
         size_feature = Feature.objects.create(title='size')
         thermal_feature = Feature.objects.create(title='thermal')
@@ -134,6 +241,38 @@ class OrderViewTest(TestCase):
         self.assertFalse(response.data.get('error'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_get_single_order_not_modified(self):
+        response = client.get(reverse('client_order', args=(1,)))
+        etag = response['ETag']
+        response = client.get(reverse('client_order', args=(1,)), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_get_single_order_modified_after_update(self):
+        response = client.get(reverse('client_order', args=(1,)))
+        etag = response['ETag']
+        feature_value = FeaturesValue.objects.get(id=1)
+        client.post(reverse('client_order', args=(1,)),
+                    {'data': [{'product': 1, 'count': 2, 'consume_location': ConsumeLocation.in_shop,
+                               'feature_value': feature_value.id}]})
+        response = client.get(reverse('client_order', args=(1,)), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data.get('data').get('product_list')), 1)
+
+    def test_get_single_order_modified_after_catalog_change(self):
+        product = Product.objects.get(title='water')
+        ProductOrder.objects.create(order_id=1, product=product, count=1, consume_location=ConsumeLocation.in_shop)
+        response = client.get(reverse('client_order', args=(1,)))
+        etag = response['ETag']
+        self.assertNotIn('Last-Modified', response)
+        product.title = 'renamed'
+        product.save()
+        response = client.get(reverse('client_order', args=(1,)), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data.get('data').get('product_list')[0]['product_title'], 'renamed')
+
     def test_get_others_order_403(self):
         user2 = User.objects.get(id=2)
         order = Order.objects.filter(user=user2).first()
@@ -157,6 +296,31 @@ class OrderViewTest(TestCase):
         self.assertFalse(response.data.get('error'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_get_all_order_paginated_by_cursor(self):
+        user = User.objects.get(id=1)
+        Order.objects.bulk_create([Order(user=user) for _ in range(5)])
+        orders = Order.objects.filter(user=user).order_by('id')
+        response = client.get(reverse('client_order'), {'page_size': 3})
+        self.assertEqual(response.data.get('data'), OrderSerializer(orders[:3], many=True).data)
+        response = client.get(response.data.get('next'))
+        self.assertEqual(response.data.get('data'), OrderSerializer(orders[3:6], many=True).data)
+        response = client.get(response.data.get('next'))
+        self.assertEqual(response.data.get('data'), OrderSerializer(orders[6:], many=True).data)
+        self.assertIsNone(response.data.get('next'))
+
+    def test_get_all_order_fixed_number_of_queries(self):
+        user = User.objects.get(id=1)
+        product = Product.objects.get(id=1)
+        feature_value = FeaturesValue.objects.get(id=1)
+        Order.objects.bulk_create([Order(user=user) for _ in range(20)])
+        ProductOrder.objects.bulk_create([ProductOrder(order=order, product=product, count=1, feature_value=feature_value,
+                                                       consume_location=ConsumeLocation.in_shop)
+                                          for order in Order.objects.filter(user=user) for _ in range(3)])
+        # token authentication, page of orders, product list of orders
+        with self.assertNumQueries(3):
+            response = client.get(reverse('client_order'))
+        self.assertEqual(len(response.data.get('data')), 22)
+
     def test_get_order_not_authenticated(self):
         client.logout()
         response = client.get(reverse('client_order'))
@@ -203,6 +367,54 @@ class OrderViewTest(TestCase):
         response = client.post(reverse('client_order'), {'data': [serializer.data]})
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_post_new_order_bulk_insert(self):
+        feature_value = FeaturesValue.objects.get(id=1)
+        data = [{'product': 1, 'count': count, 'consume_location': ConsumeLocation.take_away,
+                 'feature_value': feature_value.id} for count in range(1, 21)]
+        with CaptureQueriesContext(connection) as context:
+            response = client.post(reverse('client_order'), {'data': data})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        inserts = [query['sql'] for query in context.captured_queries
+                   if query['sql'].startswith('INSERT INTO "restbuck_app_productorder"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual([item['count'] for item in response.data], list(range(1, 21)))
+        self.assertEqual({item['product_title'] for item in response.data}, {'water'})
+        self.assertEqual({item['feature_value_title'] for item in response.data}, {feature_value.title})
+
+    def test_post_new_order_validates_each_item(self):
+        data = [{'product': 1, 'count': 1, 'consume_location': ConsumeLocation.take_away,
+                 'feature_value': FeaturesValue.objects.get(title='small').id},
+                {'product': 2, 'count': 1, 'consume_location': ConsumeLocation.take_away,
+                 'feature_value': FeaturesValue.objects.get(title='big').id}]
+        response = client.post(reverse('client_order'), {'data': data})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data.get('message'), {'feature_value': ['FeatureValue is not related to product']})
+        data[1]['feature_value'] = FeaturesValue.objects.get(title='hot').id
+        response = client.post(reverse('client_order'), {'data': data})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_post_new_order_not_existed_product(self):
+        data = [{'product': 1000, 'count': 1, 'consume_location': ConsumeLocation.take_away}]
+        response = client.post(reverse('client_order'), {'data': data})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('product', response.data.get('message'))
+
+    def test_post_new_order_product_out_of_64_bits(self):
+        content = '{"data": [{"product": 123456789012345678901234567890, "count": 1e400, "consume_location": 0}]}'
+        response = client.post(reverse('client_order'), content, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data.get('message')), {'product', 'count'})
+
+    def test_post_new_order_validation_queries_not_grow(self):
+        feature_value = FeaturesValue.objects.get(id=1)
+        for items_count in (1, 10, 50):
+            data = [{'product': 1, 'count': 1, 'consume_location': ConsumeLocation.take_away,
+                     'feature_value': feature_value.id}] * items_count
+            serializer = ProductOrderFlatSerializer(data=data, many=True)
+            # products, feature values
+            with self.assertNumQueries(2):
+                self.assertTrue(serializer.is_valid())
+
     def test_post_update_waiting_order(self):
         product = Product.objects.get(id=1)
         order = Order.objects.get(id=1)
@@ -214,6 +426,60 @@ class OrderViewTest(TestCase):
         response = client.post(reverse('client_order', args=(1,)), {'data': [serializer.data]})
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_post_update_waiting_order_writes_difference(self):
+        order = Order.objects.get(id=1)
+        size_values = FeaturesValue.objects.filter(feature__title='size')
+        kept, changed, removed = [ProductOrder.objects.create(product_id=1, order=order, count=1, feature_value=value,
+                                                              consume_location=location)
+                                  for value, location in ((size_values[0], ConsumeLocation.take_away),
+                                                          (size_values[1], ConsumeLocation.take_away),
+                                                          (size_values[0], ConsumeLocation.in_shop))]
+        data = [ProductOrderFlatSerializer(kept).data, ProductOrderFlatSerializer(changed).data,
+                {'product': 2, 'count': 1, 'consume_location': ConsumeLocation.in_shop,
+                 'feature_value': FeaturesValue.objects.get(title='hot').id}]
+        data[1]['count'] = 3
+        response = client.post(reverse('client_order', args=(order.id,)), {'data': data})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([item['count'] for item in response.data], [1, 3, 1])
+        self.assertEqual(response.data[2]['product_title'], 'milk')
+        items = ProductOrder.objects.filter(order=order)
+        self.assertEqual(items.count(), 3)
+        self.assertTrue(items.filter(id=kept.id, count=1).exists())
+        self.assertTrue(items.filter(id=changed.id, count=3).exists())
+        self.assertFalse(items.filter(id=removed.id).exists())
+
+    def test_post_order_totals_with_cost_snapshot(self):
+        small = FeaturesValue.objects.get(title='small').id
+        data = [{'product': 1, 'count': 2, 'consume_location': ConsumeLocation.take_away, 'feature_value': small},
+                {'product': 2, 'count': 1, 'consume_location': ConsumeLocation.take_away,
+                 'feature_value': FeaturesValue.objects.get(title='hot').id}]
+        response = client.post(reverse('client_order'), {'data': data})
+        self.assertEqual([item['unit_cost'] for item in response.data], [2, 4])
+        order = Order.objects.latest('id')
+        self.assertEqual((order.total_cost, order.item_count), (8, 3))
+
+        Product.objects.filter(id=1).update(cost=10)
+        data = [{'product': 1, 'count': 3, 'consume_location': ConsumeLocation.take_away, 'feature_value': small},
+                {'product': 1, 'count': 1, 'consume_location': ConsumeLocation.in_shop, 'feature_value': small}]
+        client.post(reverse('client_order', args=(order.id,)), {'data': data})
+        response = client.get(reverse('client_order', args=(order.id,)))
+        # kept item keeps its order time cost, new item gets current cost
+        self.assertEqual([item['unit_cost'] for item in response.data.get('data')['product_list']], [2, 10])
+        self.assertEqual(response.data.get('data')['total_cost'], 16)
+        self.assertEqual(response.data.get('data')['item_count'], 4)
+        order.refresh_from_db()
+        self.assertEqual((order.total_cost, order.item_count), (16, 4))
+
+    def test_update_totals(self):
+        order = Order.objects.get(id=1)
+        ProductOrder.objects.create(product_id=1, order=order, count=2, consume_location=ConsumeLocation.in_shop)
+        ProductOrder.objects.create(product_id=2, order=order, count=1, consume_location=ConsumeLocation.in_shop)
+        with self.assertNumQueries(1):
+            self.assertEqual(Order.objects.filter(id__in=(1, 2)).update_totals(), 2)
+        order.refresh_from_db()
+        self.assertEqual((order.total_cost, order.item_count), (8, 3))
+        self.assertEqual(Order.objects.get(id=2).total_cost, 0)
+
     def test_post_update_not_waiting_order(self):
         product = Product.objects.get(id=1)
         user = User.objects.get(id=1)
@@ -248,6 +514,244 @@ class OrderViewTest(TestCase):
         self.assertEqual(returned_order, None)
         self.assertEqual(response_status, status.HTTP_404_NOT_FOUND)
 
+    def test_get_object_deleted_404(self):
+        user = User.objects.get(id=1)
+        order = Order.objects.filter(user=user).first()
+        order.is_deleted = True
+        order.save()
+        returned_order, response_status = OrderView.get_object(order.id, user=user)
+        self.assertEqual(returned_order, None)
+        self.assertEqual(response_status, status.HTTP_404_NOT_FOUND)
+
+    def test_order_api_query_budgets(self):
+        user = User.objects.get(id=1)
+        feature_value = FeaturesValue.objects.get(id=1)
+        for items_count in (1, 10, 50):
+            data = [{'product': 1, 'count': count, 'consume_location': ConsumeLocation.take_away,
+                     'feature_value': feature_value.id} for count in range(1, items_count + 1)]
+            # token authentication, products, feature values, order, items and savepoint of test transaction
+            with self.assertQueryBudget(7, 'create order with {} items'.format(items_count)):
+                response = client.post(reverse('client_order'), {'data': data})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            order = Order.objects.filter(user=user).latest('id')
+
+            data = [dict(item, count=item['count'] + 1) for item in data[1:]] + \
+                   [{'product': 2, 'count': 1, 'consume_location': ConsumeLocation.in_shop,
+                     'feature_value': FeaturesValue.objects.get(title='hot').id}]
+            # order, products, feature values, order revision, current items, delete, update, insert and savepoint
+            with self.assertQueryBudget(10, 'modify order with {} items'.format(items_count)):
+                response = client.post(reverse('client_order', args=(order.id,)), {'data': data})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+            # order, product list
+            with self.assertQueryBudget(2, 'get order with {} items'.format(items_count)):
+                response = client.get(reverse('client_order', args=(order.id,)))
+            self.assertEqual(len(response.data.get('data')['product_list']), items_count)
+
+            # page of orders, product list of orders
+            with self.assertQueryBudget(2, 'list orders'):
+                response = client.get(reverse('client_order'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # order, update
+        with self.assertQueryBudget(2, 'cancel order'):
+            response = client.delete(reverse('client_order', args=(order.id,)))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_get_object_one_query(self):
+        user = User.objects.get(id=1)
+        order = Order.objects.filter(user=user).first()
+        others_order = Order.objects.exclude(user=user).first()
+        with self.assertNumQueries(1):
+            OrderView.get_object(order.id, user=user)
+        with self.assertNumQueries(1):
+            OrderView.get_object(others_order.id, user=user, with_product_list=True)
+        # order, product list
+        with self.assertNumQueries(2):
+            returned_order, response_status = OrderView.get_object(order.id, user=user, with_product_list=True)
+            OrderSerializer(returned_order).data
+
+
+class BatchOrderViewTest(QueryBudgetMixin, TestCase):
+    def setUp(self) -> None:
+        size_feature = Feature.objects.create(title='size')
+        thermal_feature = Feature.objects.create(title='thermal')
+        self.small = FeaturesValue.objects.create(title='small', feature=size_feature)
+        self.hot = FeaturesValue.objects.create(title='hot', feature=thermal_feature)
+        self.water = Product.objects.create(title='water', cost=2, feature=size_feature)
+        self.milk = Product.objects.create(title='milk', cost=4, feature=thermal_feature)
+        self.user = User.objects.create(username='test1', password='Ronash#1234')
+        token = Token.objects.create(user=self.user)
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def order_data(self, count=1):
+        return [{'product': self.water.id, 'count': count, 'consume_location': ConsumeLocation.take_away,
+                 'feature_value': self.small.id},
+                {'product': self.milk.id, 'count': 1, 'consume_location': ConsumeLocation.in_shop,
+                 'feature_value': self.hot.id}]
+
+    def test_post_batch(self):
+        response = client.post(reverse('client_order_batch'), {'data': [self.order_data(1), self.order_data(2)]})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(response.data.get('error'))
+        orders = Order.objects.for_user(self.user).order_by('id')
+        self.assertEqual([(order.total_cost, order.item_count) for order in orders], [(6, 2), (8, 3)])
+        self.assertEqual(response.data.get('data')[1]['data'], OrderSerializer(orders[1]).data)
+        self.assertEqual(ProductOrder.objects.count(), 4)
+
+    def test_post_batch_partial_failure(self):
+        not_related = self.order_data()
+        not_related[1]['feature_value'] = self.small.id
+        not_existed = [{'product': 1000, 'count': 1, 'consume_location': ConsumeLocation.take_away}]
+        response = client.post(reverse('client_order_batch'),
+                               {'data': [not_related, self.order_data(), not_existed]})
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.data.get('data')
+        self.assertEqual(results[0], {'error': True,
+                                      'message': {'feature_value': ['FeatureValue is not related to product']}})
+        self.assertFalse(results[1]['error'])
+        self.assertIn('product', results[2]['message'])
+        self.assertEqual(list(Order.objects.values_list('id', flat=True)), [results[1]['data']['id']])
+
+    def test_post_batch_all_failed(self):
+        response = client.post(reverse('client_order_batch'), {'data': [[{'product': 1000}]]})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(response.data.get('error'))
+        self.assertFalse(Order.objects.exists())
+
+    def test_post_batch_not_valid(self):
+        for data in ([], 'abc', [self.order_data()] * 101):
+            response = client.post(reverse('client_order_batch'), {'data': data})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertTrue(response.data.get('error'))
+
+    def test_post_batch_query_budget(self):
+        # caches token
+        client.get(reverse('get_menu'))
+        for orders_count in (1, 10, 50):
+            # products and feature values of all orders, orders, items and savepoint of test transaction
+            budget = 5 + (1 if connection.features.can_return_rows_from_bulk_insert else orders_count)
+            with self.assertQueryBudget(budget, 'batch of {} orders'.format(orders_count)):
+                response = client.post(reverse('client_order_batch'), {'data': [self.order_data()] * orders_count})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class IdempotencyTest(TestCase):
+    def setUp(self) -> None:
+        feature = Feature.objects.create(title='size')
+        self.feature_value = FeaturesValue.objects.create(title='small', feature=feature)
+        self.product = Product.objects.create(title='water', cost=2, feature=feature)
+        self.user = User.objects.create(username='test1', password='Ronash#1234')
+        token = Token.objects.create(user=self.user)
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def order_data(self, count=1):
+        return {'data': [{'product': self.product.id, 'count': count, 'consume_location': ConsumeLocation.take_away,
+                          'feature_value': self.feature_value.id}]}
+
+    def test_retried_create_replayed(self):
+        response = client.post(reverse('client_order'), self.order_data(), HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # stored response by key
+        with self.assertNumQueries(1):
+            retry = client.post(reverse('client_order'), self.order_data(), HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.content, response.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+        client.post(reverse('client_order'), self.order_data(), HTTP_IDEMPOTENCY_KEY='key-2')
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_retried_modify_and_cancel_replayed(self):
+        order = Order.objects.create(user=self.user)
+        url = reverse('client_order', args=(order.id,))
+        for _ in range(2):
+            response = client.post(url, self.order_data(3), HTTP_IDEMPOTENCY_KEY='modify')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order.refresh_from_db()
+        self.assertEqual(order.revision, 2)
+        for _ in range(2):
+            response = client.delete(url, HTTP_IDEMPOTENCY_KEY='cancel')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # without key, canceled order is not found
+        self.assertEqual(client.delete(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_key_reused_by_another_request(self):
+        client.post(reverse('client_order'), self.order_data(1), HTTP_IDEMPOTENCY_KEY='key-1')
+        response = client.post(reverse('client_order'), self.order_data(2), HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_duplicate_of_request_in_progress(self):
+        fingerprint = 'in progress'
+        with mock.patch('restbuck_app.idempotency.request_fingerprint', return_value=fingerprint):
+            IdempotencyKey.objects.create(user=self.user, key='key-1', fingerprint=fingerprint)
+            response = client.post(reverse('client_order'), self.order_data(), HTTP_IDEMPOTENCY_KEY='key-1')
+            self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+            self.assertEqual(response['Retry-After'], '1')
+            # abandoned request is taken over
+            IdempotencyKey.objects.update(created_at=timezone.now() - datetime.timedelta(minutes=5))
+            response = client.post(reverse('client_order'), self.order_data(), HTTP_IDEMPOTENCY_KEY='key-1')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, status.HTTP_201_CREATED)
+
+    def test_failed_request_not_stored(self):
+        with mock.patch('restbuck_app.views.Order.save', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                client.post(reverse('client_order'), self.order_data(), HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertFalse(IdempotencyKey.objects.exists())
+        response = client.post(reverse('client_order'), self.order_data(), HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_clear_expired_keys(self):
+        client.post(reverse('client_order'), self.order_data(), HTTP_IDEMPOTENCY_KEY='key-1')
+        client.post(reverse('client_order'), self.order_data(), HTTP_IDEMPOTENCY_KEY='key-2')
+        IdempotencyKey.objects.filter(key='key-1').update(created_at=timezone.now() - datetime.timedelta(days=2))
+        out = StringIO()
+        call_command('clear_idempotency_keys', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'deleted: 1')
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['key-2'])
+
+
+class OrderExportViewTest(QueryBudgetMixin, TestCase):
+    def setUp(self) -> None:
+        feature = Feature.objects.create(title='size')
+        feature_value = FeaturesValue.objects.create(title='small', feature=feature)
+        product = Product.objects.create(title='water', cost=2, feature=feature)
+        self.user = User.objects.create(username='test1', password='Ronash#1234')
+        other_user = User.objects.create(username='test2', password='Ronash#1234')
+        Order.objects.bulk_create([Order(user=self.user) for _ in range(5)] + [Order(user=other_user)])
+        ProductOrder.objects.bulk_create([ProductOrder(order=order, product=product, count=1, unit_cost=2,
+                                                       feature_value=feature_value,
+                                                       consume_location=ConsumeLocation.in_shop)
+                                          for order in Order.objects.all() for _ in range(2)])
+        Order.objects.filter(id=3).update(is_deleted=True)
+        token = Token.objects.create(user=self.user)
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def export(self):
+        response = client.get(reverse('client_order_export'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_export_all_active_orders(self):
+        orders = Order.objects.for_user(self.user).active().order_by('id')
+        self.assertEqual(self.export(), json.loads(json.dumps(OrderSerializer(orders, many=True).data)))
+
+    def test_export_in_chunks(self):
+        with mock.patch.object(OrderExportView, 'chunk_size', 2):
+            # token authentication, orders cursor, product lists of 2 chunks
+            with self.assertQueryBudget(4, 'export of 4 orders in chunks of 2'):
+                lines = self.export()
+        self.assertEqual([order['id'] for order in lines], [1, 2, 4, 5])
+        self.assertEqual({len(order['product_list']) for order in lines}, {2})
+
+    def test_export_not_authenticated(self):
+        client.logout()
+        response = client.get(reverse('client_order_export'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
 
 class FeatureValueSerializerTest(TestCase):
     def setUp(self) -> None:
@@ -364,7 +868,7 @@ class ProductOrderFlatSerializerTest(TestCase):
 
     def test_contain_expected_fields(self):
         data = self.serializer.data
-        self.assertCountEqual(data.keys(), ['product', 'product_title', 'count', 'consume_location',
+        self.assertCountEqual(data.keys(), ['product', 'product_title', 'count', 'unit_cost', 'consume_location',
                                             'consume_location_display', 'feature_value', 'feature_value_title'])
 
     def test_product_title_field_content(self):
@@ -409,7 +913,7 @@ class OrderSerializerTest(TestCase):
 
     def test_contain_expected_fields(self):
         data = self.serializer.data
-        self.assertCountEqual(data.keys(), ['id', 'state', 'product_list'])
+        self.assertCountEqual(data.keys(), ['id', 'state', 'total_cost', 'item_count', 'product_list'])
 
     def test_id_field_content(self):
         data = self.serializer.data
@@ -423,3 +927,762 @@ class OrderSerializerTest(TestCase):
         data = self.serializer.data
         self.assertEqual(data['product_list'], ProductOrderFlatSerializer(self.order.productorder_set, read_only=True,
                                                                           many=True).data)
+
+
+class FastSerializerTest(TestCase):
+    def setUp(self) -> None:
+        generate_data(users=2, orders=20, items_per_order=3)
+        self.render = JSONRenderer().render
+
+    def test_order_same_json(self):
+        Order.objects.create(user=User.objects.first(), state=OrderStatus.ready)
+        orders = list(Order.objects.with_product_list())
+        self.assertTrue(any(item.feature_value_id is None
+                            for order in orders for item in order.productorder_set.all()))
+        self.assertEqual(self.render([serialize_order(order) for order in orders]),
+                         self.render(OrderSerializer(orders, many=True).data))
+
+    def test_product_order_same_json_for_unsaved_item(self):
+        product = Product.objects.exclude(feature=None).first()
+        item = ProductOrder(product=product, count='2', unit_cost='3', consume_location=str(ConsumeLocation.in_shop),
+                            feature_value=product.feature.featuresvalue_set.first())
+        self.assertEqual(self.render(serialize_product_order(item)),
+                         self.render(ProductOrderFlatSerializer(item).data))
+
+    def test_product_same_json(self):
+        self.assertTrue(Product.objects.filter(feature=None).exists())
+        products = ProductSerializer.setup_eager_loading(Product.objects.all())
+        self.assertEqual(self.render([serialize_product(product) for product in products]),
+                         self.render(ProductSerializer(products, many=True).data))
+
+    def test_measure_serialization(self):
+        results = measure_serialization(orders=10, repeat=1)
+        self.assertEqual(results['order_page']['objects'], 10)
+        self.assertEqual(results['menu']['objects'], 6)
+
+
+class FastJSONTest(TestCase):
+    data = OrderedDict([
+        ('title', gettext_lazy('take away')),
+        ('consume_location', ConsumeLocation.types),
+        ('created', datetime.datetime(2021, 3, 1, 10, 30, 5, 123456, tzinfo=datetime.timezone.utc)),
+        ('day', datetime.date(2021, 3, 1)),
+        ('cost', Decimal('2.50')),
+        ('text', 'caf\u00e9 \u2028 "quoted"'),
+        ('nested', [{'id': 1, 'value': None, 'ok': True}]),
+    ])
+
+    def assertSameRendering(self, data, accepted_media_type=None):
+        self.assertEqual(FastJSONRenderer().render(data, accepted_media_type),
+                         JSONRenderer().render(data, accepted_media_type))
+
+    def test_render_same_as_json_renderer(self):
+        self.assertSameRendering(self.data)
+        self.assertSameRendering(self.data, 'application/json; indent=4')
+        self.assertSameRendering(None)
+        # not supported by orjson, rendered by stdlib json
+        self.assertSameRendering({'big': 2 ** 70})
+        self.assertSameRendering({1: 'one'})
+
+    def test_render_without_orjson(self):
+        with mock.patch('restbuck_app.renderers.orjson', None):
+            self.assertSameRendering(self.data)
+
+    def test_parse(self):
+        content = JSONRenderer().render(self.data)
+        expected = JSONParser().parse(BytesIO(content))
+        self.assertEqual(FastJSONParser().parse(BytesIO(content)), expected)
+        with mock.patch('restbuck_app.parsers.orjson', None):
+            self.assertEqual(FastJSONParser().parse(BytesIO(content)), expected)
+        for not_valid in (b'{"a": ', b'{"a": NaN}'):
+            with self.assertRaises(ParseError):
+                FastJSONParser().parse(BytesIO(not_valid))
+
+    def test_parse_numbers_out_of_64_bits(self):
+        for content in (b'{"product": 123456789012345678901234567890}', b'{"count": 18446744073709551616}',
+                        b'{"cost": 1e400}', b'{"cost": -1e400}', b'[1, "12345678901234567890123"]',
+                        b'[-9223372036854775809]', b'[-9999999999999999999]'):
+            expected = JSONParser().parse(BytesIO(content))
+            self.assertEqual(FastJSONParser().parse(BytesIO(content)), expected)
+        self.assertEqual(FastJSONParser().parse(BytesIO(b'{"product": 123456789012345678901234567890}')),
+                         {'product': 123456789012345678901234567890})
+
+    def test_render_floats_same_value(self):
+        data = {'values': [1e16, 1e-7, 0.1, 2.5, 1e22]}
+        content = FastJSONRenderer().render(data)
+        self.assertEqual(JSONParser().parse(BytesIO(content)), data)
+
+    def test_measure_json(self):
+        generate_data(users=1, orders=5, items_per_order=2)
+        results = measure_json(orders=5, repeat=1)
+        self.assertIn(results['engine'], ('orjson', 'json'))
+        self.assertGreater(results['order_page']['bytes'], 0)
+
+
+class OrderNotificationTest(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(username='test1', password='Ronash#1234', email='test1@example.com')
+        self.order = Order.objects.create(user=self.user)
+
+    def test_state_change_writes_outbox_without_sending(self):
+        self.order.state = OrderStatus.preparation
+        self.order.save()
+        self.assertEqual(len(mail.outbox), 0)
+        notification = OrderNotification.objects.get(order=self.order)
+        self.assertEqual(notification.previous_state, OrderStatus.waiting)
+        self.assertEqual(notification.new_state, OrderStatus.preparation)
+
+    def test_save_without_state_change_writes_nothing(self):
+        self.order.save()
+        self.assertFalse(OrderNotification.objects.exists())
+
+    def test_deliver_pending_notifications(self):
+        self.order.state = OrderStatus.ready
+        self.order.save()
+        self.assertEqual(deliver_pending_notifications(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
+        self.assertIn('from waiting state to ready', mail.outbox[0].body)
+        self.assertIsNotNone(OrderNotification.objects.get(order=self.order).sent_at)
+        self.assertEqual(deliver_pending_notifications(), (0, 0))
+
+    def test_deliver_failed_notification_retried_with_backoff(self):
+        self.order.state = OrderStatus.ready
+        self.order.save()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError):
+            self.assertEqual(deliver_pending_notifications(), (0, 1))
+        notification = OrderNotification.objects.get(order=self.order)
+        self.assertEqual(notification.attempts, 1)
+        self.assertGreater(notification.next_attempt_at, timezone.now())
+        self.assertEqual(deliver_pending_notifications(), (0, 0))
+        OrderNotification.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(deliver_pending_notifications(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_deliver_gives_up_after_max_attempts(self):
+        self.order.state = OrderStatus.ready
+        self.order.save()
+        OrderNotification.objects.update(attempts=outbox.MAX_ATTEMPTS - 1)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError):
+            deliver_pending_notifications()
+        self.assertTrue(OrderNotification.objects.get(order=self.order).failed)
+
+    def test_deliver_batch_over_one_connection(self):
+        for state in (OrderStatus.preparation, OrderStatus.ready, OrderStatus.delivered):
+            self.order.state = state
+            self.order.save()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open') as open_connection:
+            self.assertEqual(deliver_pending_notifications(), (3, 0))
+        self.assertEqual(open_connection.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_deliver_batch_with_one_send_call(self):
+        for state in (OrderStatus.preparation, OrderStatus.ready, OrderStatus.delivered):
+            self.order.state = state
+            self.order.save()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        autospec=True, side_effect=lambda backend, messages: len(messages)) as send_messages:
+            self.assertEqual(deliver_pending_notifications(), (3, 0))
+        self.assertEqual([len(call.args[1]) for call in send_messages.call_args_list], [3])
+
+    def test_deliver_failed_batch_one_by_one(self):
+        bad_user = User.objects.create(username='test2', password='Ronash#1234', email='bad@example.com')
+        bad_order = Order.objects.create(user=bad_user)
+        for order in (self.order, bad_order):
+            order.state = OrderStatus.ready
+            order.save()
+
+        def send_messages(backend, messages):
+            if any(message.to == [bad_user.email] for message in messages):
+                raise smtplib.SMTPRecipientsRefused({bad_user.email: (550, b'no such user')})
+            return len(messages)
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        autospec=True, side_effect=send_messages):
+            self.assertEqual(deliver_pending_notifications(), (1, 1))
+        self.assertIsNotNone(OrderNotification.objects.get(order=self.order).sent_at)
+        bad_notification = OrderNotification.objects.get(order=bad_order)
+        self.assertIsNone(bad_notification.sent_at)
+        self.assertEqual(bad_notification.attempts, 1)
+        self.assertIn('SMTPRecipientsRefused', bad_notification.last_error)
+
+    def test_send_notifications_command(self):
+        self.order.state = OrderStatus.delivered
+        self.order.save()
+        call_command('send_notifications', '--once', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class OrderChangeStateTest(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(username='test1', password='Ronash#1234', email='test1@example.com')
+        Order.objects.bulk_create([Order(user=self.user) for _ in range(200)])
+
+    def test_change_state_fixed_number_of_queries(self):
+        # select orders to change, update them, insert notifications (sqlite inserts at most 111 rows per query)
+        with self.assertNumQueries(3):
+            changed = Order.objects.filter(id__lte=100).change_state(OrderStatus.ready)
+        self.assertEqual(changed, 100)
+        self.assertEqual(Order.objects.filter(state=OrderStatus.ready, previous_state=OrderStatus.ready).count(), 100)
+        self.assertEqual(OrderNotification.objects.filter(previous_state=OrderStatus.waiting,
+                                                          new_state=OrderStatus.ready).count(), 100)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_change_state_just_moves_forward(self):
+        Order.objects.filter(id__lte=10).update(state=OrderStatus.delivered, previous_state=OrderStatus.delivered)
+        Order.objects.filter(id__gt=10, id__lte=20).update(is_deleted=True)
+        changed = Order.objects.all().change_state(OrderStatus.preparation)
+        self.assertEqual(changed, 180)
+        self.assertEqual(Order.objects.filter(state=OrderStatus.delivered).count(), 10)
+        self.assertEqual(OrderNotification.objects.count(), 180)
+
+    def test_admin_bulk_action(self):
+        admin_user = User.objects.create_superuser(username='manager', password='Ronash#1234')
+        admin_client = Client()
+        admin_client.force_login(admin_user)
+        selected = list(Order.objects.values_list('id', flat=True)[:50])
+        response = admin_client.post(reverse('admin:restbuck_app_order_changelist'),
+                                     {'action': 'mark_preparation', '_selected_action': selected})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(Order.objects.filter(state=OrderStatus.preparation).count(), 50)
+        self.assertEqual(OrderNotification.objects.count(), 50)
+
+
+class AdminChangelistTest(TestCase):
+    def setUp(self) -> None:
+        self.feature = Feature.objects.create(title='size')
+        self.feature_value = FeaturesValue.objects.create(title='small', feature=self.feature)
+        self.product = Product.objects.create(title='water', cost='2', feature=self.feature)
+        admin_user = User.objects.create_superuser(username='manager', password='Ronash#1234')
+        self.admin_client = Client()
+        self.admin_client.force_login(admin_user)
+
+    def add_orders(self, orders_count):
+        for i in range(orders_count):
+            user = User.objects.create(username='client' + str(User.objects.count()))
+            order = Order.objects.create(user=user)
+            ProductOrder.objects.bulk_create([ProductOrder(order=order, product=self.product, count=2,
+                                                           consume_location=ConsumeLocation.in_shop,
+                                                           feature_value=self.feature_value,
+                                                           unit_cost=self.product.cost)] * 2)
+
+    def changelist_queries_count(self, url_name):
+        with CaptureQueriesContext(connection) as context:
+            response = self.admin_client.get(reverse(url_name))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries)
+
+    def test_changelist_fixed_number_of_queries(self):
+        for url_name in ('admin:restbuck_app_order_changelist', 'admin:restbuck_app_productorder_changelist',
+                         'admin:restbuck_app_ordernotification_changelist'):
+            self.add_orders(2)
+            Order.objects.all().change_state(OrderStatus.preparation)
+            few_orders_queries = self.changelist_queries_count(url_name)
+            self.add_orders(20)
+            Order.objects.all().change_state(OrderStatus.ready)
+            self.assertEqual(self.changelist_queries_count(url_name), few_orders_queries)
+
+    def test_admin_item_changes_update_order_totals(self):
+        order = Order.objects.create(user=User.objects.create(username='client'))
+        response = self.admin_client.post(reverse('admin:restbuck_app_productorder_add'), {
+            'product': self.product.id, 'order': order.id, 'count': 3, 'consume_location': ConsumeLocation.in_shop,
+            'feature_value': self.feature_value.id})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        item = ProductOrder.objects.get(order=order)
+        self.assertEqual(item.unit_cost, 2)
+        order.refresh_from_db()
+        self.assertEqual((order.total_cost, order.item_count), (6, 3))
+        response = self.admin_client.post(reverse('admin:restbuck_app_productorder_delete', args=(item.id,)),
+                                          {'post': 'yes'})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        order.refresh_from_db()
+        self.assertEqual((order.total_cost, order.item_count), (0, 0))
+
+    def test_admin_product_change_snapshots_cost(self):
+        other_product = Product.objects.create(title='coffee', cost='9', feature=self.feature)
+        self.add_orders(1)
+        order = Order.objects.get()
+        Order.objects.filter(pk=order.pk).update_totals()
+        item = order.productorder_set.first()
+        response = self.admin_client.post(reverse('admin:restbuck_app_productorder_change', args=(item.id,)), {
+            'product': other_product.id, 'order': order.id, 'count': 2, 'consume_location': ConsumeLocation.in_shop,
+            'feature_value': self.feature_value.id})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        item.refresh_from_db()
+        self.assertEqual(item.unit_cost, 9)
+        order.refresh_from_db()
+        self.assertEqual((order.total_cost, order.item_count), (22, 4))
+
+    def test_admin_inline_product_change_snapshots_cost(self):
+        other_product = Product.objects.create(title='coffee', cost='9', feature=self.feature)
+        self.add_orders(1)
+        order = Order.objects.get()
+        items = list(order.productorder_set.order_by('id'))
+        data = {'user': order.user_id, 'state': order.state, 'previous_state': order.previous_state,
+                'revision': order.revision, 'productorder_set-TOTAL_FORMS': 3,
+                'productorder_set-INITIAL_FORMS': 2, 'productorder_set-MIN_NUM_FORMS': 0,
+                'productorder_set-MAX_NUM_FORMS': 1000}
+        for number, item in enumerate(items):
+            prefix = 'productorder_set-{}-'.format(number)
+            data.update({prefix + 'id': item.id, prefix + 'order': order.id, prefix + 'product': item.product_id,
+                         prefix + 'count': item.count, prefix + 'consume_location': item.consume_location,
+                         prefix + 'feature_value': item.feature_value_id})
+        data['productorder_set-1-product'] = other_product.id
+        response = self.admin_client.post(reverse('admin:restbuck_app_order_change', args=(order.id,)), data)
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual([item.unit_cost for item in order.productorder_set.order_by('id')], [2, 9])
+        order.refresh_from_db()
+        self.assertEqual((order.total_cost, order.item_count), (22, 4))
+
+    def test_order_product_summary(self):
+        self.add_orders(1)
+        response = self.admin_client.get(reverse('admin:restbuck_app_order_changelist'))
+        self.assertContains(response, '2*water, 2*water')
+
+
+class SharedCacheCheckTest(TestCase):
+    def test_shared_cache(self):
+        self.assertEqual(check_shared_cache(None), [])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache(self):
+        errors = check_shared_cache(None)
+        self.assertEqual([error.id for error in errors], ['restbuck_app.E001'])
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(username='test1', password='Ronash#1234')
+        self.token = Token.objects.create(user=self.user)
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_token_resolved_from_cache(self):
+        client.get(reverse('client_order'))
+        # just orders list
+        with self.assertNumQueries(1):
+            response = client.get(reverse('client_order'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_shared_cache_used_when_local_cache_missed(self):
+        client.get(reverse('client_order'))
+        CachedTokenAuthentication.local_cache.clear()
+        with self.assertNumQueries(1):
+            response = client.get(reverse('client_order'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_deleted_token_invalidated(self):
+        client.get(reverse('client_order'))
+        self.token.delete()
+        response = client.get(reverse('client_order'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_invalidated(self):
+        client.get(reverse('client_order'))
+        self.user.is_active = False
+        self.user.save()
+        response = client.get(reverse('client_order'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_auth_version_read_once_per_interval(self):
+        client.get(reverse('client_order'))
+        with mock.patch('restbuck_app.authentication.get_version', wraps=get_version) as read_version:
+            # just orders list, nothing read from shared cache
+            with self.assertNumQueries(1):
+                client.get(reverse('client_order'))
+            self.assertEqual(read_version.call_count, 0)
+            with mock.patch.object(CachedTokenAuthentication, 'version_check_seconds', -1):
+                client.get(reverse('client_order'))
+            self.assertEqual(read_version.call_count, 1)
+
+    def test_auth_version_change_of_other_process(self):
+        client.get(reverse('client_order'))
+        # another process deactivated the user: shared entry removed and version bumped
+        User.objects.filter(pk=self.token.user_id).update(is_active=False)
+        cache.delete(TOKEN_KEY.format(self.token.key))
+        bump_version(AUTH_VERSION_KEY)
+        self.assertEqual(client.get(reverse('client_order')).status_code, status.HTTP_200_OK)
+        with mock.patch.object(CachedTokenAuthentication, 'version_check_seconds', -1):
+            self.assertEqual(client.get(reverse('client_order')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cached_user_copied_for_each_request(self):
+        authentication = CachedTokenAuthentication()
+        user, token = authentication.authenticate_credentials(self.token.key)
+        user.first_name = 'changed by a request'
+        cached_user, cached_token = authentication.authenticate_credentials(self.token.key)
+        self.assertIsNot(cached_user, user)
+        self.assertEqual(cached_user.first_name, '')
+        self.assertIs(cached_token.user, cached_user)
+
+    def test_lru_cache_bounded_with_ttl(self):
+        lru_cache = LRUCache(max_size=2, timeout=60)
+        lru_cache.set('a', 1)
+        lru_cache.set('b', 2)
+        lru_cache.get('a')
+        lru_cache.set('c', 3)
+        self.assertEqual((lru_cache.get('a'), lru_cache.get('b'), lru_cache.get('c')), (1, None, 3))
+        lru_cache.timeout = -1
+        lru_cache.set('d', 4)
+        self.assertIsNone(lru_cache.get('d'))
+
+
+@override_settings(RESTBUCK_ASYNC_THREAD_SENSITIVE=True)
+class AsyncViewsTest(TestCase):
+    def setUp(self) -> None:
+        size_feature = Feature.objects.create(title='size')
+        FeaturesValue.objects.create(title='small', feature=size_feature)
+        Product.objects.create(title='water', cost='2', feature=size_feature)
+        self.user = User.objects.create(username='test1', password='Ronash#1234', is_staff=True)
+        Order.objects.create(user=self.user)
+        self.token = Token.objects.create(user=self.user)
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.async_client = AsyncClient()
+        self.auth = {'AUTHORIZATION': 'Token ' + self.token.key}
+
+    async def test_menu_same_as_sync(self):
+        response = await self.async_client.get(reverse('async_get_menu'), **self.auth)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        sync_response = await sync_to_async(client.get)(reverse('get_menu'))
+        self.assertEqual(response.content, sync_response.content)
+        self.assertEqual(response['ETag'], sync_response['ETag'])
+
+    async def test_menu_not_authenticated(self):
+        response = await AsyncClient().get(reverse('async_get_menu'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_client_order_same_as_sync(self):
+        for args in ((), (1,), (1000,)):
+            response = await self.async_client.get(reverse('async_client_order', args=args), **self.auth)
+            sync_response = await sync_to_async(client.get)(reverse('client_order', args=args))
+            self.assertEqual(response.status_code, sync_response.status_code)
+            self.assertEqual(json.loads(response.content), json.loads(sync_response.content))
+
+    async def test_post_new_order(self):
+        data = {'data': [{'product': 1, 'count': 2, 'consume_location': ConsumeLocation.in_shop,
+                          'feature_value': 1}]}
+        response = await self.async_client.post(reverse('async_client_order'), json.dumps(data),
+                                                content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(json.loads(response.content)[0]['product_title'], 'water')
+
+    async def test_barista_queue_long_poll(self):
+        response = await self.async_client.get(reverse('async_barista_queue'), **self.auth)
+        version = json.loads(response.content)['version']
+        # query string is put in path, AsyncClient of django 3.1 drops query data of GET
+        path = reverse('async_barista_queue') + '?' + urlencode({'version': version, 'wait': 0.3})
+        response = await self.async_client.get(path, **self.auth)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        await sync_to_async(Order.objects.create)(user=self.user)
+        path = reverse('async_barista_queue') + '?' + urlencode({'version': version, 'wait': 5})
+        response = await self.async_client.get(path, **self.auth)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(response.content)['data']), 2)
+
+    async def test_wait_for_queue_change(self):
+        version = await sync_to_async(get_version)(ORDER_QUEUE_VERSION_KEY)
+        self.assertEqual(await wait_for_queue_change(version, 0.3), version)
+
+        async def change_queue():
+            await asyncio.sleep(0.3)
+            await sync_to_async(bump_version)(ORDER_QUEUE_VERSION_KEY)
+
+        change_task = asyncio.ensure_future(change_queue())
+        started = time.monotonic()
+        self.assertNotEqual(await wait_for_queue_change(version, 5), version)
+        self.assertLess(time.monotonic() - started, 1)
+        await change_task
+
+
+class AsyncConcurrencyTest(TransactionTestCase):
+    """ requests run on an event loop of their own, like under an ASGI server, not in the loop of async tests. """
+
+    def setUp(self) -> None:
+        self.barista = User.objects.create(username='barista', password='Ronash#1234', is_staff=True)
+        self.token = Token.objects.create(user=self.barista)
+        self.auth = {'AUTHORIZATION': 'Token ' + self.token.key}
+
+    def test_request_not_blocked_by_long_poll(self):
+        async def requests():
+            async_client = AsyncClient()
+            response = await async_client.get(reverse('async_barista_queue'), **self.auth)
+            path = reverse('async_barista_queue') + '?' + urlencode(
+                {'version': json.loads(response.content)['version'], 'wait': 2})
+            long_poll = asyncio.ensure_future(async_client.get(path, **self.auth))
+            await asyncio.sleep(0.2)
+            started = time.monotonic()
+            response = await async_client.get(reverse('async_get_menu'), **self.auth)
+            menu_seconds = time.monotonic() - started
+            return response, menu_seconds, long_poll.done(), await long_poll
+
+        response, menu_seconds, long_poll_done, long_poll_response = asyncio.run(requests())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLess(menu_seconds, 1)
+        self.assertFalse(long_poll_done)
+        self.assertEqual(long_poll_response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_client_order_in_thread_pool(self):
+        # default setting, views run in a thread pool with database connections of their own
+        feature = Feature.objects.create(title='size')
+        product = Product.objects.create(title='water', cost='2', feature=feature)
+        for _ in range(2):
+            order = Order.objects.create(user=self.barista)
+            ProductOrder.objects.create(order=order, product=product, count=1,
+                                        consume_location=ConsumeLocation.in_shop)
+
+        async def requests():
+            async_client = AsyncClient()
+            return await asyncio.gather(*(async_client.get(reverse('async_client_order'), **self.auth)
+                                          for _ in range(5)))
+
+        sync_client = APIClient()
+        sync_client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        expected = json.loads(sync_client.get(reverse('client_order')).content)
+        registry.clear()
+        for response in asyncio.run(requests()):
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(json.loads(response.content), expected)
+        # queries of pool threads are counted
+        self.assertGreaterEqual(registry.get('async_client_order', 'GET').queries, 5)
+
+    def test_measure_asgi(self):
+        generate_data(users=2, orders=6, items_per_order=2)
+        results = measure_asgi(requests=4, concurrency=2, long_polls=1, long_poll_wait=0.5)
+        self.assertEqual(set(results), {'menu', 'async_menu', 'order_list', 'async_order_list',
+                                        'async_menu_long_poll'})
+        for result in results.values():
+            self.assertEqual((result['requests'], result['concurrency']), (4, 2))
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+
+class BaristaQueueViewTest(QueryBudgetMixin, TestCase):
+    def setUp(self) -> None:
+        feature = Feature.objects.create(title='size')
+        feature_value = FeaturesValue.objects.create(title='small', feature=feature)
+        product = Product.objects.create(title='water', cost='2', feature=feature)
+        customer = User.objects.create(username='test1', password='Ronash#1234')
+        for state in (OrderStatus.preparation, OrderStatus.waiting, OrderStatus.ready, OrderStatus.waiting):
+            order = Order.objects.create(user=customer, state=state)
+            ProductOrder.objects.create(order=order, product=product, count=1, feature_value=feature_value,
+                                        consume_location=ConsumeLocation.take_away)
+        Order.objects.create(user=customer, is_deleted=True)
+        barista = User.objects.create(username='barista', password='Ronash#1234', is_staff=True)
+        self.barista_token = Token.objects.create(user=barista)
+        self.customer_token = Token.objects.create(user=customer)
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.barista_token.key)
+
+    def test_get_open_orders_oldest_first(self):
+        response = client.get(reverse('barista_queue'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        orders = Order.objects.filter(state__in=(OrderStatus.waiting, OrderStatus.preparation),
+                                      is_deleted=False).order_by('id')
+        self.assertEqual(response.data.get('data'), OrderSerializer(orders, many=True).data)
+        self.assertEqual([order['id'] for order in response.data.get('data')], [1, 2, 4])
+
+    def test_get_queue_fixed_number_of_queries(self):
+        # token authentication, orders, product lists
+        with self.assertNumQueries(3):
+            client.get(reverse('barista_queue'))
+
+    def test_get_queue_query_budget(self):
+        customer = User.objects.get(username='test1')
+        product = Product.objects.get(title='water')
+        for queue_size in (3, 23):
+            # token authentication, orders, product lists
+            with self.assertQueryBudget(3, 'queue of {} orders'.format(queue_size)):
+                response = client.get(reverse('barista_queue'))
+            self.assertEqual(len(response.data.get('data')), queue_size)
+            Order.objects.bulk_create([Order(user=customer) for _ in range(20)])
+            ProductOrder.objects.bulk_create([ProductOrder(order=order, product=product, count=1,
+                                                           consume_location=ConsumeLocation.in_shop)
+                                              for order in Order.objects.filter(productorder=None)])
+
+    def test_get_queue_not_staff(self):
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.customer_token.key)
+        response = client.get(reverse('barista_queue'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_not_changed(self):
+        version = client.get(reverse('barista_queue')).data.get('version')
+        # token and queue version are read from cache, sync view does not wait
+        started = time.monotonic()
+        with self.assertNumQueries(0):
+            response = client.get(reverse('barista_queue'), {'version': version, 'wait': 5})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_changed(self):
+        version = client.get(reverse('barista_queue')).data.get('version')
+        Order.objects.create(user=User.objects.get(username='test1'))
+        response = client.get(reverse('barista_queue'), {'version': version, 'wait': 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data.get('data')), 4)
+        self.assertNotEqual(response.data.get('version'), version)
+
+    def test_not_valid_version(self):
+        response = client.get(reverse('barista_queue'), {'version': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MetricsTest(QueryBudgetMixin, TestCase):
+    def setUp(self) -> None:
+        customer = User.objects.create(username='test1', password='Ronash#1234')
+        Order.objects.create(user=customer)
+        barista = User.objects.create(username='barista', password='Ronash#1234', is_staff=True)
+        self.barista_token = Token.objects.create(user=barista)
+        self.customer_token = Token.objects.create(user=customer)
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.barista_token.key)
+        registry.clear()
+
+    def test_record_request_metrics(self):
+        # token authentication, orders, product lists
+        response = client.get(reverse('barista_queue'))
+        metrics = registry.get('barista_queue', 'GET')
+        self.assertEqual(metrics.requests, 1)
+        self.assertEqual(metrics.queries, 3)
+        self.assertGreater(metrics.db_seconds, 0)
+        self.assertGreater(metrics.render_seconds, 0)
+        self.assertEqual(metrics.response_bytes, len(response.content))
+        self.assertEqual(sum(metrics.duration_buckets), 1)
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(RESTBUCK_SERVER_TIMING=True)
+    def test_server_timing_header(self):
+        response = client.get(reverse('barista_queue'))
+        self.assertRegex(response['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="3 queries", render;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_metrics_endpoint(self):
+        client.get(reverse('barista_queue'))
+        response = client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        content = response.content.decode()
+        self.assertIn('restbuck_request_queries_sum{view="barista_queue",method="GET"} 3\n', content)
+        self.assertIn('restbuck_request_duration_seconds_bucket{view="barista_queue",method="GET",le="+Inf"} 1\n',
+                      content)
+
+    def test_metrics_endpoint_query_budget(self):
+        # token authentication, metrics are in memory
+        with self.assertQueryBudget(1, 'metrics'):
+            client.get(reverse('metrics'))
+
+    def test_metrics_endpoint_not_staff(self):
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.customer_token.key)
+        response = client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_render_cumulative_buckets(self):
+        metrics = MetricsRegistry()
+        metrics.record('get_menu', 'GET', 0.003, 1, 0.001, 0.001, 10)
+        metrics.record('get_menu', 'GET', 0.2, 2, 0.1, 0.01, 20)
+        content = metrics.render_prometheus()
+        self.assertIn('restbuck_request_duration_seconds_bucket{view="get_menu",method="GET",le="0.005"} 1\n', content)
+        self.assertIn('restbuck_request_duration_seconds_bucket{view="get_menu",method="GET",le="0.25"} 2\n', content)
+        self.assertIn('restbuck_request_duration_seconds_count{view="get_menu",method="GET"} 2\n', content)
+        self.assertIn('restbuck_response_bytes_sum{view="get_menu",method="GET"} 30\n', content)
+
+    @override_settings(RESTBUCK_ASYNC_THREAD_SENSITIVE=True)
+    async def test_record_async_request_metrics(self):
+        auth = {'AUTHORIZATION': 'Token ' + self.barista_token.key}
+        response = await AsyncClient().get(reverse('async_get_menu'), **auth)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        metrics = registry.get('async_get_menu', 'GET')
+        self.assertEqual(metrics.requests, 1)
+        self.assertEqual(metrics.response_bytes, len(response.content))
+
+    @override_settings(RESTBUCK_ASYNC_THREAD_SENSITIVE=True)
+    async def test_record_queries_under_asgi(self):
+        auth = {'AUTHORIZATION': 'Token ' + self.barista_token.key}
+        await sync_to_async(client.get)(reverse('barista_queue'))
+        registry.clear()
+        # sync view run by django in its sync thread and async view, token is cached: orders, product lists
+        for url_name in ('barista_queue', 'async_barista_queue'):
+            response = await AsyncClient().get(reverse(url_name), **auth)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            metrics = registry.get(url_name, 'GET')
+            self.assertEqual(metrics.queries, 2)
+            self.assertGreater(metrics.db_seconds, 0)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'query plan format of sqlite')
+class QueryPlanTest(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(username='test1', password='Ronash#1234')
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        self.assertIn('USING', plan)
+        self.assertIsNone(re.search(r'\bSCAN\b(?!.*\bUSING\b)', plan), plan)
+
+    def test_order_queries_use_index(self):
+        self.assertUsesIndex(Order.objects.for_user(self.user).active().order_by('id'))
+        self.assertUsesIndex(Order.objects.for_user(self.user).active().filter(id__gt=10).order_by('id')[:50])
+        self.assertUsesIndex(Order.objects.active().filter(pk=1))
+        self.assertUsesIndex(Order.objects.active().filter(state=OrderStatus.waiting).order_by('id'))
+        self.assertUsesIndex(Order.objects.active().filter(state__in=(OrderStatus.waiting, OrderStatus.preparation)))
+        self.assertUsesIndex(Order.objects.open())
+
+    def test_product_list_query_uses_index(self):
+        self.assertUsesIndex(ProductOrder.objects.filter(order__in=[1, 2, 3]))
+
+    def test_feature_values_query_uses_index(self):
+        self.assertUsesIndex(FeaturesValue.objects.filter(id__in=[1, 2, 3]))
+        self.assertUsesIndex(FeaturesValue.objects.filter(feature__in=[1, 2]))
+
+    def test_pending_notifications_query_uses_index(self):
+        self.assertUsesIndex(OrderNotification.objects.pending().order_by('next_attempt_at'))
+
+
+class NotifyTest(TestCase):
+    def test_flush_queued_emails_in_batches(self):
+        notify = ClientOrderStatusChange()
+        notify.batch_size = 2
+        for order_id in range(5):
+            notify.queue_email('client@example.com', order_id, 'waiting', 'ready')
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        autospec=True, side_effect=lambda backend, messages: len(messages)) as send_messages:
+            with notify:
+                self.assertEqual(notify.flush(), 5)
+        self.assertEqual([len(call.args[1]) for call in send_messages.call_args_list], [2, 2, 1])
+        self.assertEqual(notify.sent_per_connection, [5])
+        self.assertEqual(notify.queued_messages, [])
+
+    def test_reconnect_stale_connection(self):
+        notify = ClientOrderStatusChange()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=[smtplib.SMTPServerDisconnected, 1]):
+            with notify:
+                self.assertEqual(notify.send_email('client@example.com', 1, 'waiting', 'ready'), 1)
+        self.assertEqual(notify.connections_opened, 2)
+        self.assertEqual(notify.sent_per_connection, [0, 1])
+        self.assertEqual(notify.sent_count, 1)
+
+
+class BenchmarkTest(TestCase):
+    def test_init_fixture_loads(self):
+        call_command('loaddata', 'init', verbosity=0)
+        self.assertEqual(Product.objects.count(), 6)
+        self.assertFalse(Product.objects.exclude(feature=None).filter(feature__featuresvalue=None).exists())
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+
+    def test_generate_data(self):
+        tokens = generate_data(users=3, orders=10, items_per_order=2)
+        self.assertEqual(len(tokens), 3)
+        self.assertEqual(Order.objects.count(), 10)
+        self.assertEqual(Order.objects.filter(user=tokens[0].user).count(), 4)
+        self.assertEqual(ProductOrder.objects.count(), 20)
+        self.assertFalse(ProductOrder.objects.exclude(feature_value=None)
+                         .exclude(feature_value__feature=models.F('product__feature')).exists())
+
+    def test_run_benchmark(self):
+        results = run_benchmark(users=2, orders=6, items_per_order=2, requests=3)
+        self.assertEqual(set(results), {'menu', 'order_list', 'order_detail', 'order_create', 'order_modify',
+                                        'order_cancel'})
+        for result in results.values():
+            self.assertEqual(result['requests'], 3)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertEqual(Order.objects.filter(is_deleted=True).count(), 3)
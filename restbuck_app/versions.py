@@ -0,0 +1,50 @@
+"""
+Version numbers of data changed rarely and read often, shared between processes through django cache.
+
+A version is bumped on every change of its data, readers cache or compare data by version instead of querying it.
+The default cache backend must be shared between processes, see :mod:`restbuck_app.checks`.
+"""
+import random
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+CATALOG_VERSION_KEY = 'restbuck_app:catalog:version'
+ORDER_QUEUE_VERSION_KEY = 'restbuck_app:order_queue:version'
+AUTH_VERSION_KEY = 'restbuck_app:auth:version'
+
+
+def new_version():
+    """ a version not used before.
+
+    versions are set, not incremented, as increment of some backends (e.g. database) is not atomic. the current time
+    keeps a version from being reused after cache eviction, random low digits keep processes from setting same one.
+
+    :rtype: int
+    """
+    return int(time.time() * 1000) * 1000 + random.randrange(1000)
+
+
+def get_version(key):
+    """ current version of data.
+
+    :rtype: int
+    """
+    version = cache.get(key)
+    if version is None:
+        initial_version = new_version()
+        cache.add(key, initial_version, timeout=None)
+        version = cache.get(key, initial_version)
+    return version
+
+
+def bump_version(key):
+    """ mark data as changed.
+
+    version is changed right away and once more after commit, so data read before commit by another process
+    is never kept as the new version.
+    """
+    cache.set(key, new_version(), timeout=None)
+    transaction.on_commit(lambda: cache.set(key, new_version(), timeout=None))
+
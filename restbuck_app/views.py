@@ -1,26 +1,52 @@
+import itertools
+
 import rest_framework
 from rest_framework import status
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.http import Http404
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from restbuck_app import catalog
+from restbuck_app.metrics import registry
+from restbuck_app.authentication import CachedTokenAuthentication
+from restbuck_app.idempotency import idempotent
 from restbuck_app.models import *
+from restbuck_app.pagination import OrderCursorPagination
+from restbuck_app.renderers import FastJSONRenderer
 from restbuck_app.serializers import *
+from restbuck_app.versions import ORDER_QUEUE_VERSION_KEY, get_version
 
 
 # TODO: user GenericAPIView or better GenericViewSet
 class Menu(APIView):
     """ handle list of products for client order """
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        """ GET: all product with their feature and features values """
-        products = Product.objects.all()
-        data = ProductSerializer(products, many=True).data
-        return Response({'data': data,
-                         'error': False})
+        """ GET: all product with their feature and features values, served from catalog cache.
+
+        answers 304 if client has the menu of current catalog version (If-None-Match).
+        """
+        version = catalog.get_catalog_version()
+        etag = catalog.menu_etag(version)
+        response = not_modified_response(request, etag)
+        if response is None:
+            data, content = catalog.get_menu(self.build_menu, version)
+            response = catalog.PreRenderedResponse(data, content)
+        response['ETag'] = etag
+        return response
+
+    @staticmethod
+    def build_menu():
+        """ serialize menu response data from database. """
+        products = ProductSerializer.setup_eager_loading(Product.objects.all())
+        data = [serialize_product(product) for product in products]
+        return {'data': data,
+                'error': False}
 
 
 def get_auth_user(request):
@@ -28,44 +54,63 @@ def get_auth_user(request):
     return request.user
 
 
+def first_error(errors):
+    """ errors of first invalid item of a list serializer, or errors of whole list if it is not a list. """
+    if isinstance(errors, list):
+        return next((item_errors for item_errors in errors if item_errors), {})
+    return errors
+
+
+def not_modified_response(request, etag, last_modified=None):
+    """ check conditional GET headers of request (If-None-Match, If-Modified-Since).
+
+    :param etag: current entity tag of requested resource.
+    :param last_modified: last modification time of requested resource.
+    :type last_modified: datetime.datetime
+    :returns: 304 response if client copy is still valid, otherwise None
+    """
+    last_modified_timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=last_modified_timestamp)
+
+
 # TODO: user GenericAPIView or better GenericViewSet
 class OrderView(APIView):
     """ handle client order API """
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = OrderCursorPagination
 
     @staticmethod
-    def get_object(pk: int, user: User):
-        """ get order by id and check if is related to request user.
+    def get_object(pk: int, user: User, with_product_list=False):
+        """ get order by id and check if is related to request user, in one query.
 
         :param user: Order owner, an User onject
         :param pk: primary key or id of Order.
+        :param with_product_list: prefetch product list of order if it is related to user.
         :returns: Order object (or None if can not find related object) and  status code to return to user.
         :rtype: Order
         :rtype: rest_framework.status
         """
-        if Order.objects.filter(pk=pk, is_deleted=False).exists():
-            order = Order.objects.get(pk=pk)
-            response_status = status.HTTP_200_OK
-            if order.user != user:
-                response_status = status.HTTP_403_FORBIDDEN
-                order = None
-            return order, response_status
-        else:
+        order = Order.objects.active().filter(pk=pk).first()
+        if order is None:
             return None, status.HTTP_404_NOT_FOUND
+        if order.user_id != user.id:
+            return None, status.HTTP_403_FORBIDDEN
+        if with_product_list:
+            prefetch_related_objects([order], OrderQuerySet.product_list_prefetch())
+        return order, status.HTTP_200_OK
 
     def get(self, request, pk=0):
-        """ GET: user's order by id, or all of his order if no pk provided
+        """ GET: user's order by id, or all of his order if no pk provided, paginated by cursor (see 'next' link)
 
         :param request: API request
         :param pk: primary key or id of Order.
         :type pk: int
         :return: API response data and status code
         """
-        data = []
         user = get_auth_user(request)
         if pk > 0:
-            order, response_status = self.get_object(pk, user)
+            order, response_status = self.get_object(pk, user, with_product_list=True)
             # TODO: need help, use DRF tools like "get or 404"
             if response_status == status.HTTP_404_NOT_FOUND:
                 return Response({'error': True, 'message': 'requested order dose not exist'}, response_status)
@@ -73,17 +118,25 @@ class OrderView(APIView):
             elif response_status == status.HTTP_403_FORBIDDEN:
                 return Response({'error': True, 'message': 'Not your order'}, response_status)
             elif response_status == status.HTTP_200_OK:
-                data = OrderSerializer(order).data
+                # no Last-Modified, catalog changes (e.g. product titles) do not change modification time of order
+                etag = order.get_etag(catalog.get_catalog_version())
+                response = not_modified_response(request, etag)
+                if response is None:
+                    response = Response({'data': serialize_order(order),
+                                         'error': False})
+                response['ETag'] = etag
+                return response
         elif pk < 0:
             return Response({'error': True, 'message': 'Not valid order id'}, status.HTTP_400_BAD_REQUEST)
         else:
-            orders = Order.objects.filter(user=user, is_deleted=False)
-            for order in orders:
-                data.append(OrderSerializer(order).data)
-        # TODO: check for empty product list
-        return Response({'data': data,
-                         'error': False})
+            orders = Order.objects.for_user(user).active().with_product_list()
+            paginator = self.pagination_class()
+            page = paginator.paginate_queryset(orders, request, view=self)
+            # TODO: check for empty product list
+            data = [serialize_order(order) for order in page]
+            return paginator.get_paginated_response(data)
 
+    @idempotent
     def delete(self, request, pk=0):
         """ DELETE: user can delete his waiting order by id.
 
@@ -109,6 +162,7 @@ class OrderView(APIView):
         else:
             return Response({'error': True, 'message': 'Not valid order id'}, status.HTTP_400_BAD_REQUEST)
 
+    @idempotent
     def post(self, request, pk=0):
         """
         POST: new order of user or change 'waiting' order.
@@ -131,15 +185,143 @@ class OrderView(APIView):
         elif pk < 0:
             return Response({'error': True, 'message': 'Not valid order id'}, status.HTTP_400_BAD_REQUEST)
         data = request.data.get('data')
-        serializer = ProductOrderFlatSerializer(data=data, many=True)
+        items = None
+        if order is not None:
+            items = ProductOrder.objects.filter(order=order).select_related('product', 'feature_value')
+        serializer = ProductOrderFlatSerializer(instance=items, data=data, many=True)
         if serializer.is_valid():
-            if order is None:
-                order = Order.objects.create(user=user)
-            # TODO: must be changed for production, specially without log due to the possibility of Integrity
-            tobe_deleted = ProductOrder.objects.filter(order=order)
-            if tobe_deleted.exists():
-                tobe_deleted.delete()
-            serializer.save(order=order)
+            with transaction.atomic():
+                if order is None:
+                    order = Order(user=user)
+                    order.set_totals(ProductOrder(**attrs) for attrs in serializer.validated_data)
+                    order.save()
+                    serializer.save(order=order)
+                else:
+                    # changing order writes just the difference of product list
+                    order.set_totals(serializer.save(order=order))
+                    order.touch('total_cost', 'item_count')
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
-            return Response({'error': True, 'message': serializer.errors[0]}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({'error': True, 'message': first_error(serializer.errors)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+
+class BatchOrderView(APIView):
+    """ handle placing many orders of client in one request, e.g. queued orders of a kiosk after reconnecting """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    max_batch_size = 100
+
+    @idempotent
+    def post(self, request):
+        """
+        POST: new orders of user, 'data' is a list of product lists, each one like the product list of OrderView.
+
+        all orders are validated against one catalog snapshot (products and feature values loaded once), valid
+        orders are inserted in bulk in one transaction and invalid ones are reported by their index.
+
+        :param request: API request
+        :return: result of each order, 201 if all orders are placed, 207 if some of them and 400 if none.
+        """
+        user = get_auth_user(request)
+        data = request.data.get('data')
+        if not isinstance(data, list) or not data or len(data) > self.max_batch_size:
+            return Response({'error': True,
+                             'message': 'Not valid batch, send 1 to {} orders'.format(self.max_batch_size)},
+                            status.HTTP_400_BAD_REQUEST)
+        context = {}
+        order_serializers = [ProductOrderFlatSerializer(data=items, many=True, context=context) for items in data]
+        order_serializers[0].preload_catalog([item for items in data if isinstance(items, list) for item in items])
+
+        results, orders, items_of_orders = [], [], []
+        for serializer in order_serializers:
+            if serializer.is_valid():
+                items = [ProductOrder(**attrs) for attrs in serializer.validated_data]
+                order = Order(user=user)
+                order.set_totals(items)
+                orders.append(order)
+                items_of_orders.append(items)
+                results.append((order, items))
+            else:
+                results.append({'error': True, 'message': first_error(serializer.errors)})
+        if orders:
+            Order.objects.bulk_create_with_items(orders, items_of_orders)
+
+        response_data = []
+        for result in results:
+            if isinstance(result, dict):
+                response_data.append(result)
+            else:
+                order, items = result
+                response_data.append({'data': serialize_order(order, items), 'error': False})
+        if len(orders) == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif orders:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({'data': response_data, 'error': not orders}, response_status)
+
+
+class OrderExportView(APIView):
+    """ handle streaming export of whole order history of client, for accounts with many orders """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    chunk_size = 500
+
+    def get(self, request):
+        """ GET: all orders of user as NDJSON, one serialized order per line, oldest first.
+
+        orders are read with a database cursor in chunks and product lists are prefetched per chunk, so memory
+        does not grow with history size and the first chunk is sent before the next ones are read.
+        """
+        orders = Order.objects.for_user(get_auth_user(request)).active().order_by('id')
+        return StreamingHttpResponse(self.stream_orders(orders), content_type='application/x-ndjson')
+
+    def stream_orders(self, orders):
+        renderer = FastJSONRenderer()
+        orders = orders.iterator(chunk_size=self.chunk_size)
+        while True:
+            chunk = list(itertools.islice(orders, self.chunk_size))
+            if not chunk:
+                break
+            prefetch_related_objects(chunk, OrderQuerySet.product_list_prefetch())
+            yield b''.join(renderer.render(serialize_order(order)) + b'\n' for order in chunk)
+
+
+class BaristaQueue(APIView):
+    """ handle staff work queue API, orders to prepare """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """ GET: waiting and in preparation orders, oldest first with their product list.
+
+        with 'version' of last response, 304 is sent if queue did not change (checked in cache, not database).
+        'wait' is ignored, waiting would hold a sync worker. long polling is served by the async version of this API,
+        see :func:`restbuck_app.async_views.barista_queue`.
+
+        :param request: API request
+        :return: API response data and queue version
+        """
+        try:
+            client_version = request.query_params.get('version')
+            client_version = int(client_version) if client_version is not None else None
+        except ValueError:
+            return Response({'error': True, 'message': 'Not valid version'}, status.HTTP_400_BAD_REQUEST)
+        version = get_version(ORDER_QUEUE_VERSION_KEY)
+        if version == client_version:
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        orders = Order.objects.open().with_product_list()
+        return Response({'data': [serialize_order(order) for order in orders],
+                         'version': version,
+                         'error': False})
+
+
+class Metrics(APIView):
+    """ handle staff metrics API, request metrics of this process in Prometheus text format """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(registry.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')